@@ -1,10 +1,23 @@
 import arcpy
 import pythonaddins
+import asyncio
+import base64
+import gzip
+import hashlib
 import json
-import urllib.request
-import urllib.error
+import math
+import numpy
+import requests
 import sys
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the stdlib encoder
+    orjson = None
 
 # Add the addon directory to path to import context_collector
 addon_dir = os.path.dirname(__file__)
@@ -14,13 +27,122 @@ if addon_dir not in sys.path:
 from context_collector import ContextCollector
 
 SERVER_URL = "http://localhost:8080"
+GENERATE_URL = f"{SERVER_URL}/api/generate"
+REGENERATE_URL = f"{SERVER_URL}/api/regenerate"
+ANALYZE_URL = f"{SERVER_URL}/api/analyze-screenshot"
+MAX_FIX_ATTEMPTS = 3
+
+# How long a context prefetched during the confirmation dialog stays usable
+PREFETCH_MAX_AGE = 30
+
+# Also send a screenshot of the map to the vision model with every request
+ENABLE_VISION = False
+
+# (connect, read) timeouts: the server is local, only the LLM call is slow
+REQUEST_TIMEOUT = (3, 60)
+
+# Bodies above this size are gzipped if the server accepts it. On localhost
+# this rarely triggers; it pays off when the backend runs remotely.
+COMPRESS_THRESHOLD = 32 * 1024
+
+
+def _dumps(obj):
+    """Serialize obj to UTF-8 encoded JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+
+def _loads(data):
+    """Parse UTF-8 encoded JSON bytes"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data.decode('utf-8'))
+
+
+def _digest(data):
+    """Short stable id for a byte string"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _join_json(obj_bytes, key, value_bytes):
+    """Append an already serialized value under key to a serialized JSON object"""
+    separator = b',' if len(obj_bytes) > 2 else b''
+    return obj_bytes[:-1] + separator + _dumps(key) + b':' + value_bytes + b'}'
+
+
+def _encode_context(context):
+    """
+    Serialize a context snapshot once for all requests that carry it
+    
+    Returns:
+        tuple: (context id, JSON bytes). The collection timestamp is not
+        part of the id, so an unchanged project keeps the same id.
+    """
+    body = _dumps({k: v for k, v in context.items() if k != 'timestamp'})
+    context_id = _digest(body)
+    if 'timestamp' in context:
+        body = _join_json(body, 'timestamp', _dumps(context['timestamp']))
+    return context_id, body
+
 
 class AIAssistantTool(object):
     """Implementation for AI Assistant tool - Autonomous GIS Engineer"""
+    # Shared by every click so the loop and its worker threads are created once
+    _loop = None
+    _executor = None
+    
     def __init__(self):
         self.enabled = True
         self.checked = False
         self.context_collector = ContextCollector()
+        self.screenshot_handler = None
+        if ENABLE_VISION:
+            # Pillow and numba are only needed for vision, so they stay off the load path
+            from screenshot_handler import ScreenshotHandler
+            self.screenshot_handler = ScreenshotHandler()
+        
+        # Keep connections to the backend alive across generate/regenerate calls
+        self._session = requests.Session()
+        self._session.mount(SERVER_URL, HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        
+        # Context ids the server already holds, so they can be sent by reference
+        self._known_contexts = set()
+        
+        # Whether the server accepts gzipped bodies, learned on first use
+        self._server_accepts_gzip = None
+        
+        # Base globals for generated code. Each run executes in its own copy,
+        # shared by its fix attempts, so names left by an earlier prompt
+        # cannot leak into unrelated code
+        self._exec_globals = {
+            'arcpy': arcpy,
+            'math': math,
+            'os': os,
+            'numpy': numpy,
+            'np': numpy,
+            '__builtins__': __builtins__
+        }
+        
+        # Progress messages, written to the message window in one call per flush
+        self._msg_buf = []
+        
+        # (future, started_at) of a context collected while the user was
+        # deciding on the previous answer
+        self._prefetched = None
+        
+        # Prompt whose answer the user rejected or that failed to run; asking
+        # it again must not return the server's cached copy of that answer
+        self._rejected_prompt = None
+    
+    @classmethod
+    def _get_loop(cls):
+        """Return the persistent event loop that drives AI requests"""
+        if cls._loop is None or cls._loop.is_closed():
+            cls._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ai_tool")
+            cls._loop = asyncio.new_event_loop()
+            cls._loop.set_default_executor(cls._executor)
+        return cls._loop
     
     def onClick(self):
         """Called when the tool button is clicked"""
@@ -34,115 +156,239 @@ class AIAssistantTool(object):
             if not user_input:
                 return
             
-            arcpy.AddMessage("=" * 60)
-            arcpy.AddMessage(f"Запрос: {user_input}")
-            arcpy.AddMessage("=" * 60)
-            
-            # Collect context
-            arcpy.AddMessage("Сбор контекста проекта...")
-            context = self.context_collector.collect_full_context()
-            
-            # Show context summary
-            arcpy.AddMessage(f"Проект: {context['project']['name']}")
-            arcpy.AddMessage(f"Доступно слоев: {len(context['layers'])}")
-            for layer in context['layers'][:5]:  # Show first 5
-                arcpy.AddMessage(f"  - {layer['name']} ({layer.get('geometryType', 'N/A')}, {layer['featureCount']} объектов)")
-            if len(context['layers']) > 5:
-                arcpy.AddMessage(f"  ... и еще {len(context['layers']) - 5} слоев")
-            
-            arcpy.AddMessage("\nОтправка запроса в AI...")
-            
-            code, explanation, warnings = self.send_to_ai(user_input, context)
-            
-            if code:
-                arcpy.AddMessage("\n" + "=" * 60)
-                arcpy.AddMessage("AI ОТВЕТ:")
-                arcpy.AddMessage("=" * 60)
-                arcpy.AddMessage(f"Объяснение: {explanation}")
-                
-                if warnings:
-                    for warning in warnings:
-                        arcpy.AddWarning(f"⚠️ {warning}")
-                
-                arcpy.AddMessage("\nГенерированный код:")
-                arcpy.AddMessage("-" * 60)
-                arcpy.AddMessage(code)
-                arcpy.AddMessage("-" * 60)
-                
-                # Ask for confirmation
-                confirm = pythonaddins.MessageBox(
-                    f"Выполнить сгенерированный код?\n\n{explanation}\n\nКод:\n{code[:200]}...",
-                    "Подтверждение выполнения",
-                    1  # Yes/No
-                )
-                
-                if confirm == "Yes":
-                    arcpy.AddMessage("\nВыполнение кода...")
-                    try:
-                        # Execute in controlled environment
-                        exec_globals = {
-                            'arcpy': arcpy,
-                            '__builtins__': __builtins__
-                        }
-                        exec(code, exec_globals)
-                        arcpy.AddMessage("\n✅ Код успешно выполнен!")
-                    except Exception as e:
-                        error_msg = str(e)
-                        arcpy.AddError(f"❌ Ошибка выполнения: {error_msg}")
-                        
-                        # Try to regenerate
-                        arcpy.AddMessage("\nПопытка исправления ошибки...")
-                        fixed_code = self.regenerate_code(user_input, code, error_msg, context)
-                        
-                        if fixed_code:
-                            arcpy.AddMessage("AI исправил код. Повторная попытка...")
-                            try:
-                                exec(fixed_code, exec_globals)
-                                arcpy.AddMessage("✅ Исправленный код выполнен успешно!")
-                            except Exception as e2:
-                                arcpy.AddError(f"❌ Ошибка повторного выполнения: {str(e2)}")
-                else:
-                    arcpy.AddMessage("Выполнение отменено пользователем")
-            else:
-                arcpy.AddError("Не удалось получить код от AI")
-                
+            self._get_loop().run_until_complete(self._pipeline(user_input))
+            self._flush_messages()
+        
         except Exception as e:
+            self._flush_messages()
             arcpy.AddError(f"❌ Критическая ошибка: {str(e)}")
             import traceback
             arcpy.AddError(traceback.format_exc())
     
-    def send_to_ai(self, prompt, context):
-        """Send request to AI backend with full context"""
+    def _log(self, message):
+        """Queue a progress message until the next flush"""
+        self._msg_buf.append(message)
+    
+    def _flush_messages(self):
+        """Write queued messages with a single AddMessage call"""
+        if self._msg_buf:
+            arcpy.AddMessage("\n".join(self._msg_buf))
+            self._msg_buf.clear()
+    
+    async def _pipeline(self, user_input):
+        """Collect context, ask the AI for code and execute it with fix-ups"""
+        self._log("=" * 60)
+        self._log(f"Запрос: {user_input}")
+        self._log("=" * 60)
+        
+        # Collect context
+        self._log("Сбор контекста проекта...")
+        context = self._take_prefetched_context() or self.context_collector.collect_full_context()
+        
+        # Show context summary
+        self._log(f"Проект: {context['project']['name']}")
+        self._log(f"Доступно слоев: {len(context['layers'])}")
+        for layer in context['layers'][:5]:  # Show first 5
+            self._log(f"  - {layer['name']} ({layer.get('geometryType', 'N/A')}, {layer['featureCount']} объектов)")
+        if len(context['layers']) > 5:
+            self._log(f"  ... и еще {len(context['layers']) - 5} слоев")
+        
+        self._log("\nОтправка запроса в AI...")
+        self._flush_messages()
+        
+        context_id, context_bytes = _encode_context(context)
+        if self.screenshot_handler:
+            # Export the map and run the vision analysis while code is being generated
+            (code, explanation, warnings), analysis = await asyncio.gather(
+                self.send_to_ai(user_input, context_id, context_bytes),
+                self.analyze_map(user_input, context_id, context_bytes)
+            )
+            if analysis:
+                self._log(f"\nАнализ карты: {analysis}")
+        else:
+            code, explanation, warnings = await self.send_to_ai(user_input, context_id, context_bytes)
+        
+        if not code:
+            arcpy.AddError("Не удалось получить код от AI")
+            return
+        
+        self._log("\n" + "=" * 60)
+        self._log("AI ОТВЕТ:")
+        self._log("=" * 60)
+        self._log(f"Объяснение: {explanation}")
+        
+        if warnings:
+            self._flush_messages()
+            for warning in warnings:
+                arcpy.AddWarning(f"⚠️ {warning}")
+        
+        self._log("\nГенерированный код:")
+        self._log("-" * 60)
+        self._log(code)
+        self._log("-" * 60)
+        self._flush_messages()
+        
+        # Collect the next turn's context while the user reads the answer
+        prefetch = self._executor.submit(self.context_collector.collect_full_context)
+        
+        # Ask for confirmation
+        confirm = pythonaddins.MessageBox(
+            f"Выполнить сгенерированный код?\n\n{explanation}\n\nКод:\n{code[:200]}...",
+            "Подтверждение выполнения",
+            1  # Yes/No
+        )
+        
+        if confirm == "Yes":
+            # The code is about to change the project, so the snapshot would be
+            # stale. It is dropped without waiting for it; the collector does not
+            # cache details read before the run invalidates its cache.
+            prefetch.cancel()
+            self._log("\nВыполнение кода...")
+            succeeded = await self._execute_with_fixes(
+                user_input, code, context_id, context_bytes, dict(self._exec_globals))
+            # Code that failed leaves the context unchanged, so the server would
+            # serve the same broken answer from its cache for this prompt
+            self._rejected_prompt = None if succeeded else user_input
+        else:
+            self._prefetched = (prefetch, time.monotonic())
+            self._rejected_prompt = user_input
+            self._log("Выполнение отменено пользователем")
+    
+    def _take_prefetched_context(self):
+        """Return the context prefetched during the last confirmation if still fresh"""
+        if self._prefetched is None:
+            return None
+        
+        prefetch, started_at = self._prefetched
+        self._prefetched = None
+        if time.monotonic() - started_at > PREFETCH_MAX_AGE:
+            prefetch.cancel()
+            return None
+        
         try:
-            url = f"{SERVER_URL}/api/generate"
+            return prefetch.result()
+        except Exception:
+            return None
+    
+    async def _execute_with_fixes(self, user_input, code, context_id, context_bytes, exec_globals):
+        """Execute code, asking the AI to fix it up to MAX_FIX_ATTEMPTS times
+        
+        All attempts run in exec_globals. Returns True if the code or one of
+        its fixes ran successfully.
+        """
+        loop = asyncio.get_running_loop()
+        
+        attempt = 0
+        while True:
+            self._flush_messages()
+            try:
+                # Compile separately so syntax errors are reported before anything runs
+                compiled = compile(code, '<ai-generated>', 'exec')
+                try:
+                    exec(compiled, exec_globals)
+                finally:
+                    # Even a failed run may have edited data the caches describe
+                    self.context_collector.invalidate_cache()
+                if attempt == 0:
+                    self._log("\n✅ Код успешно выполнен!")
+                else:
+                    self._log("✅ Исправленный код выполнен успешно!")
+                return True
+            except Exception as e:
+                error_msg = str(e)
+                if attempt == 0:
+                    arcpy.AddError(f"❌ Ошибка выполнения: {error_msg}")
+                else:
+                    arcpy.AddError(f"❌ Ошибка повторного выполнения: {error_msg}")
+            
+            attempt += 1
+            if attempt > MAX_FIX_ATTEMPTS:
+                arcpy.AddError("Превышено максимальное количество попыток исправления")
+                return False
             
+            # Try to regenerate. The failed run may already have changed the
+            # project, so re-snapshot the context while the AI is working.
+            self._log("\nПопытка исправления ошибки...")
+            self._flush_messages()
+            code, context = await asyncio.gather(
+                self.regenerate_code(user_input, code, error_msg, context_id, context_bytes, attempt),
+                loop.run_in_executor(None, self.context_collector.collect_full_context)
+            )
+            context_id, context_bytes = _encode_context(context)
+            
+            if not code:
+                return False
+            self._log("AI исправил код. Повторная попытка...")
+    
+    async def _post_with_context(self, url, payload, context_id, context_bytes):
+        """POST payload with the context sent by id, uploading it only when needed"""
+        payload["contextId"] = context_id
+        data = _dumps(payload)
+        
+        if context_id not in self._known_contexts:
+            status, result = await self._post_json(url, _join_json(data, 'context', context_bytes))
+        else:
+            status, result = await self._post_json(url, data)
+            if status == 404:
+                # The server dropped the context (restart or expiry) - upload it again
+                status, result = await self._post_json(url, _join_json(data, 'context', context_bytes))
+        
+        if status < 400:
+            self._known_contexts.add(context_id)
+        return result
+    
+    async def _post_json(self, url, data):
+        """POST a JSON body on a worker thread, return (status, decoded reply)"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._post_json_sync, url, data)
+    
+    def _post_json_sync(self, url, data):
+        headers = {'Content-Type': 'application/json; charset=utf-8'}
+        if len(data) > COMPRESS_THRESHOLD and self._accepts_gzip():
+            data = gzip.compress(data, compresslevel=1)
+            headers['Content-Encoding'] = 'gzip'
+        
+        response = self._session.post(
+            url,
+            data=data,
+            headers=headers,
+            timeout=REQUEST_TIMEOUT
+        )
+        return response.status_code, _loads(response.content)
+    
+    def _accepts_gzip(self):
+        """Ask the server once (OPTIONS) whether it decodes gzipped request bodies"""
+        if self._server_accepts_gzip is None:
+            try:
+                response = self._session.options(GENERATE_URL, timeout=REQUEST_TIMEOUT)
+                self._server_accepts_gzip = 'gzip' in response.headers.get('Accept-Encoding', '')
+            except requests.exceptions.RequestException:
+                return False
+        return self._server_accepts_gzip
+    
+    async def send_to_ai(self, prompt, context_id, context_bytes):
+        """Send request to AI backend with full context"""
+        try:
             payload = {
                 "prompt": prompt,
-                "context": context
+                "promptId": _digest(prompt.encode('utf-8'))
             }
+            if prompt == self._rejected_prompt:
+                payload["noCache"] = True
             
-            data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            result = await self._post_with_context(GENERATE_URL, payload, context_id, context_bytes)
             
-            req = urllib.request.Request(
-                url,
-                data=data,
-                headers={'Content-Type': 'application/json; charset=utf-8'}
-            )
+            if 'error' in result and result['error']:
+                arcpy.AddError(f"AI Error: {result['error']}")
+                return None, None, None
             
-            with urllib.request.urlopen(req, timeout=60) as response:
-                result = json.loads(response.read().decode('utf-8'))
-                
-                if 'error' in result and result['error']:
-                    arcpy.AddError(f"AI Error: {result['error']}")
-                    return None, None, None
-                
-                return (
-                    result.get('code'),
-                    result.get('explanation'),
-                    result.get('warnings', [])
-                )
-                
-        except urllib.error.URLError as e:
+            return (
+                result.get('code'),
+                result.get('explanation'),
+                result.get('warnings', [])
+            )
+        
+        except requests.exceptions.ConnectionError as e:
             arcpy.AddError(f"❌ Ошибка подключения к серверу: {str(e)}")
             arcpy.AddError(f"Убедитесь, что сервер запущен на {SERVER_URL}")
             return None, None, None
@@ -152,42 +398,54 @@ class AIAssistantTool(object):
             arcpy.AddError(traceback.format_exc())
             return None, None, None
     
-    def regenerate_code(self, original_prompt, failed_code, error_message, context, attempt=1):
-        """Try to regenerate fixed code after error"""
-        if attempt > 3:
-            arcpy.AddError("Превышено максимальное количество попыток исправления")
-            return None
+    async def analyze_map(self, prompt, context_id, context_bytes):
+        """Export the current map and ask the vision model about it"""
+        loop = asyncio.get_running_loop()
         
         try:
-            url = f"{SERVER_URL}/api/regenerate"
+            screenshot_path = await loop.run_in_executor(None, self.screenshot_handler.capture_for_vision)
+            if not screenshot_path:
+                return None
+            
+            with open(screenshot_path, 'rb') as f:
+                image = base64.b64encode(f.read()).decode('ascii')
+            
+            payload = {
+                "prompt": prompt,
+                "imageBase64": image
+            }
             
+            result = await self._post_with_context(ANALYZE_URL, payload, context_id, context_bytes)
+            
+            if 'error' in result and result['error']:
+                arcpy.AddWarning(f"Ошибка анализа карты: {result['error']}")
+                return None
+            
+            return result.get('analysis')
+        
+        except Exception as e:
+            arcpy.AddWarning(f"Анализ карты недоступен: {str(e)}")
+            return None
+    
+    async def regenerate_code(self, original_prompt, failed_code, error_message, context_id, context_bytes, attempt=1):
+        """Try to regenerate fixed code after error"""
+        try:
             payload = {
                 "originalPrompt": original_prompt,
                 "failedCode": failed_code,
                 "errorMessage": error_message,
-                "context": context,
                 "attempt": attempt
             }
             
-            data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            result = await self._post_with_context(REGENERATE_URL, payload, context_id, context_bytes)
             
-            req = urllib.request.Request(
-                url,
-                data=data,
-                headers={'Content-Type': 'application/json; charset=utf-8'}
-            )
+            if 'error' in result and result['error']:
+                arcpy.AddError(f"Ошибка регенерации: {result['error']}")
+                return None
             
-            with urllib.request.urlopen(req, timeout=60) as response:
-                result = json.loads(response.read().decode('utf-8'))
-                
-                if 'error' in result and result['error']:
-                    arcpy.AddError(f"Ошибка регенерации: {result['error']}")
-                    return None
-                
-                arcpy.AddMessage(f"Объяснение исправления: {result.get('explanation', 'N/A')}")
-                return result.get('code')
-                
+            self._log(f"Объяснение исправления: {result.get('explanation', 'N/A')}")
+            return result.get('code')
+        
         except Exception as e:
             arcpy.AddError(f"Ошибка регенерации кода: {str(e)}")
             return None
-
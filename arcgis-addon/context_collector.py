@@ -5,9 +5,70 @@ This module collects comprehensive metadata about the ArcGIS project,
 including layers, fields, spatial references, and current map state.
 """
 
-import arcpy
 import json
-from typing import Dict, List, Optional
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the stdlib encoder
+    orjson = None
+
+# arcpy takes seconds to import, so it is loaded on first use. This keeps
+# the pure-Python helpers importable (and testable) without it.
+arcpy = None
+
+
+def _arcpy():
+    """Import arcpy on first use and return the module"""
+    global arcpy
+    if arcpy is None:
+        import arcpy as arcpy_module
+        arcpy = arcpy_module
+    return arcpy
+
+
+# How long cached layer details (feature counts, extents, fields) stay
+# valid. Not every source has an mtime that tracks edits (enterprise
+# geodatabases, services, rows edited inside a .gdb), so this bounds staleness.
+LAYER_CACHE_TTL = 60.0
+
+# Layer fields are sent column-wise: one list per attribute instead of one
+# dict per field, so the key names are not repeated for every field
+FIELDS_SCHEMA = "soa-v1"
+MAX_FIELDS = 10  # Limit fields per layer to avoid huge payloads
+
+# System fields that are not useful to the AI
+_SYS_FIELDS = frozenset({'OBJECTID', 'SHAPE', 'SHAPE_LENGTH', 'SHAPE_AREA', 'GLOBALID'})
+
+# (layer attribute, reported type), checked in order by _get_layer_type
+_LAYER_TYPE_PROBES = (
+    ('isFeatureLayer', 'FeatureLayer'),
+    ('isRasterLayer', 'RasterLayer'),
+    ('isWebLayer', 'WebLayer'),
+)
+
+# Layer data sources are described in parallel; arcpy releases the GIL while it waits
+MAX_COLLECT_WORKERS = 8
+
+# Guards the metadata caches, which worker threads share
+_cache_lock = threading.Lock()
+
+
+def _source_mtime(path: str) -> Optional[float]:
+    """Modification time of a data source or its nearest existing parent (e.g. the .gdb)"""
+    while path:
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+    return None
 
 
 class ContextCollector:
@@ -16,9 +77,24 @@ class ContextCollector:
     def __init__(self):
         self.project = None
         try:
-            self.project = arcpy.mp.ArcGISProject("CURRENT")
+            self.project = _arcpy().mp.ArcGISProject("CURRENT")
         except Exception as e:
-            arcpy.AddWarning(f"Could not access current project: {e}")
+            _arcpy().AddWarning(f"Could not access current project: {e}")
+        
+        # Keyed by (dataSource, definitionQuery); values are (mtime, stored_at, data)
+        self._layer_cache: Dict[Tuple[str, str], Tuple] = {}
+        
+        # Bumped by invalidate_cache(); details read before the bump are not cached
+        self._generation = 0
+        
+        # Maps of the project, listed once per collect_full_context call
+        self._maps = None
+    
+    def invalidate_cache(self):
+        """Drop cached layer metadata, e.g. after the project was edited"""
+        with _cache_lock:
+            self._layer_cache.clear()
+            self._generation += 1
     
     def collect_full_context(self) -> Dict:
         """
@@ -28,11 +104,14 @@ class ContextCollector:
         - Active layer
         - Current map extent
         """
+        self._maps = None
+        
         context = {
             "project": self.get_project_info(),
             "layers": self.get_all_layers(),
             "activeLayer": self.get_active_layer(),
             "mapExtent": self.get_map_extent(),
+            "schema": FIELDS_SCHEMA,
             "timestamp": arcpy.time.strftime("%Y-%m-%dT%H:%M:%S")
         }
         
@@ -50,8 +129,9 @@ class ContextCollector:
         try:
             # Get first map's spatial reference
             sr = "Unknown"
-            if self.project.listMaps():
-                first_map = self.project.listMaps()[0]
+            maps = self._list_maps()
+            if maps:
+                first_map = maps[0]
                 sr = first_map.spatialReference.name if first_map.spatialReference else "Unknown"
             
             return {
@@ -65,25 +145,67 @@ class ContextCollector:
             return {"name": "Error", "path": "", "spatialReference": "Unknown"}
     
     def get_all_layers(self) -> List[Dict]:
-        """Get metadata for all layers in all maps"""
+        """Get metadata for all layers in all maps
+        
+        Layer objects are only read on the calling thread. Details that are
+        not cached are collected from the layers' data sources in parallel
+        and merged back here.
+        """
         all_layers = []
         
         if not self.project:
             return all_layers
         
         try:
-            for map_obj in self.project.listMaps():
-                for layer in map_obj.listLayers():
-                    layer_info = self.get_layer_details(layer)
-                    if layer_info:
-                        all_layers.append(layer_info)
+            read = [
+                self._read_layer(layer)
+                for map_obj in self._list_maps()
+                for layer in map_obj.listLayers()
+                if not layer.isGroupLayer
+            ]
+            read = [item for item in read if item]
+            
+            pending = [(layer_info, source) for layer_info, source in read if source]
+            if pending:
+                workers = min(MAX_COLLECT_WORKERS, len(pending))
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    futures = [
+                        executor.submit(self._collect_source_details, *source[0])
+                        for layer_info, source in pending
+                    ]
+                for (layer_info, source), future in zip(pending, futures):
+                    self._merge_details(layer_info, source, future.result)
+            
+            all_layers = [layer_info for layer_info, source in read]
         except Exception as e:
             arcpy.AddWarning(f"Error collecting layers: {e}")
         
         return all_layers
     
+    def _list_maps(self) -> List:
+        """List project maps, reusing the list for the current collection"""
+        if self._maps is None:
+            self._maps = self.project.listMaps()
+        return self._maps
+    
     def get_layer_details(self, layer) -> Optional[Dict]:
         """Get detailed metadata for a single layer"""
+        read = self._read_layer(layer)
+        if not read:
+            return None
+        
+        layer_info, source = read
+        if source:
+            self._merge_details(layer_info, source, lambda: self._collect_source_details(*source[0]))
+        return layer_info
+    
+    def _read_layer(self, layer) -> Optional[Tuple[Dict, Optional[Tuple]]]:
+        """Read a layer's own attributes, filling in cached details
+        
+        Returns (layer_info, source), where source is ((dataSource,
+        definitionQuery), mtime, cache generation) if the details still have
+        to be collected, or None if the layer should be skipped.
+        """
         try:
             # Skip group layers
             if layer.isGroupLayer:
@@ -100,72 +222,132 @@ class ContextCollector:
             if layer.supports("DATASOURCE"):
                 layer_info["dataSource"] = layer.dataSource
             
-            # Get feature count and geometry type for feature layers
+            # Feature count and geometry type come from the feature layer's source
             if hasattr(layer, 'dataSource') and layer.supports("DEFINITIONQUERY"):
-                try:
-                    desc = arcpy.Describe(layer)
-                    
-                    if hasattr(desc, 'shapeType'):
-                        layer_info["geometryType"] = desc.shapeType
-                    
-                    if hasattr(desc, 'spatialReference'):
-                        layer_info["spatialReference"] = desc.spatialReference.name
-                    
-                    # Get feature count
-                    result = arcpy.management.GetCount(layer)
-                    layer_info["featureCount"] = int(result[0])
-                    
-                    # Get extent
-                    if hasattr(desc, 'extent'):
-                        extent = desc.extent
-                        layer_info["extent"] = {
-                            "xMin": extent.XMin,
-                            "yMin": extent.YMin,
-                            "xMax": extent.XMax,
-                            "yMax": extent.YMax
-                        }
-                    
-                    # Get fields
-                    layer_info["fields"] = self.get_layer_fields(layer)
-                    
-                    # Check if editable
-                    layer_info["isEditable"] = hasattr(desc, 'canVersion')
-                    
-                except Exception as e:
-                    arcpy.AddWarning(f"Could not get details for layer {layer.name}: {e}")
-                    layer_info["featureCount"] = 0
-            else:
-                layer_info["featureCount"] = 0
-                layer_info["spatialReference"] = "Unknown"
+                key = (layer.dataSource, getattr(layer, 'definitionQuery', '') or '')
+                mtime = _source_mtime(layer.dataSource)
+                
+                with _cache_lock:
+                    cached = self._layer_cache.get(key)
+                    generation = self._generation
+                if cached and cached[0] == mtime and time.monotonic() - cached[1] < LAYER_CACHE_TTL:
+                    layer_info.update(cached[2])
+                    return layer_info, None
+                return layer_info, (key, mtime, generation)
             
-            return layer_info
+            layer_info["featureCount"] = 0
+            layer_info["spatialReference"] = "Unknown"
+            return layer_info, None
             
         except Exception as e:
             arcpy.AddWarning(f"Error processing layer: {e}")
             return None
     
-    def get_layer_fields(self, layer) -> List[Dict]:
-        """Get field information for a layer"""
-        fields = []
+    def _merge_details(self, layer_info, source, get_details):
+        """Add the details returned by get_details() to layer_info and cache them"""
+        key, mtime, generation = source
+        try:
+            details = get_details()
+        except Exception as e:
+            arcpy.AddWarning(f"Could not get details for layer {layer_info['name']}: {e}")
+            layer_info["featureCount"] = 0
+            return
+        
+        with _cache_lock:
+            # The cache was invalidated meanwhile, these details may predate an edit
+            if generation == self._generation:
+                self._layer_cache[key] = (mtime, time.monotonic(), details)
+        layer_info.update(details)
+    
+    def _collect_source_details(self, data_source, definition_query) -> Dict:
+        """Describe a feature layer's data source (runs in a worker thread)
+        
+        Works on the data source path only, never on the layer object, and
+        raises instead of writing geoprocessing messages.
+        """
+        desc = arcpy.Describe(data_source)
+        details = {}
+        
+        if hasattr(desc, 'shapeType'):
+            details["geometryType"] = desc.shapeType
+        
+        if hasattr(desc, 'spatialReference'):
+            details["spatialReference"] = desc.spatialReference.name
+        
+        # Get feature count
+        details["featureCount"] = self._get_feature_count(data_source, desc, definition_query)
+        
+        # Get extent
+        if hasattr(desc, 'extent'):
+            extent = desc.extent
+            details["extent"] = {
+                "xMin": extent.XMin,
+                "yMin": extent.YMin,
+                "xMax": extent.XMax,
+                "yMax": extent.YMax
+            }
+        
+        # Get fields
+        details["fields"] = self._fields_from_desc(desc)
+        
+        # Check if editable
+        details["isEditable"] = hasattr(desc, 'canVersion')
+        
+        return details
+    
+    def _get_feature_count(self, data_source, desc, definition_query) -> int:
+        """Count features of a data source, applying the layer's definition query"""
+        if definition_query:
+            # The query belongs to the layer, so apply it to the source directly
+            with arcpy.da.SearchCursor(data_source, ["OID@"], where_clause=definition_query) as cursor:
+                return sum(1 for _ in cursor)
         
+        count = getattr(desc, 'featureCount', None)
+        if count is not None:
+            return int(count)
+        
+        catalog_path = getattr(desc, 'catalogPath', None) or data_source
+        return int(arcpy.management.GetCount(catalog_path)[0])
+    
+    def get_layer_fields(self, layer, desc=None) -> Dict[str, List]:
+        """Get field information for a layer as parallel lists (FIELDS_SCHEMA)
+        
+        Pass the layer's Describe result to reuse its fields instead of
+        making another geoprocessor call.
+        """
         try:
-            for field in arcpy.ListFields(layer):
-                # Skip system fields
-                if field.name.upper() in ['OBJECTID', 'SHAPE', 'SHAPE_LENGTH', 'SHAPE_AREA', 'GLOBALID']:
-                    continue
-                
-                field_info = {
-                    "name": field.name,
-                    "type": field.type,
-                    "alias": field.aliasName or field.name,
-                    "length": field.length if hasattr(field, 'length') else 0,
-                    "nullable": field.isNullable
-                }
-                fields.append(field_info)
+            if desc is None:
+                desc = arcpy.Describe(layer)
+            return self._fields_from_desc(desc)
         except Exception as e:
             arcpy.AddWarning(f"Could not get fields: {e}")
+            return self._fields_from_desc(None)
+    
+    def _fields_from_desc(self, desc) -> Dict[str, List]:
+        """Field lists (FIELDS_SCHEMA) of a Describe result; empty lists for None"""
+        names, types, aliases, lengths, nullables = [], [], [], [], []
         
-        return fields[:10]  # Limit to first 10 fields to avoid huge payloads
+        for field in getattr(desc, 'fields', None) or []:
+            # Skip system fields
+            if field.name.upper() in _SYS_FIELDS:
+                continue
+            
+            names.append(field.name)
+            types.append(field.type)
+            aliases.append(field.aliasName or field.name)
+            lengths.append(field.length if hasattr(field, 'length') else 0)
+            nullables.append(field.isNullable)
+            
+            if len(names) == MAX_FIELDS:
+                break
+        
+        return {
+            "names": names,
+            "types": types,
+            "aliases": aliases,
+            "lengths": lengths,
+            "nullables": nullables
+        }
     
     def get_active_layer(self) -> Optional[str]:
         """Get the currently active/selected layer"""
@@ -207,24 +389,24 @@ class ContextCollector:
     
     def _get_layer_type(self, layer) -> str:
         """Determine layer type"""
-        if hasattr(layer, 'isFeatureLayer') and layer.isFeatureLayer:
-            return "FeatureLayer"
-        elif hasattr(layer, 'isRasterLayer') and layer.isRasterLayer:
-            return "RasterLayer"
-        elif hasattr(layer, 'isWebLayer') and layer.isWebLayer:
-            return "WebLayer"
-        else:
-            return "Layer"
-    
-    def to_json(self) -> str:
-        """Convert context to JSON string"""
-        context = self.collect_full_context()
+        for attr, layer_type in _LAYER_TYPE_PROBES:
+            if getattr(layer, attr, False):
+                return layer_type
+        return "Layer"
+    
+    def to_json(self, context: Optional[Dict] = None) -> str:
+        """Convert context (collected now if not given) to JSON string"""
+        if context is None:
+            context = self.collect_full_context()
+        if orjson is not None:
+            return orjson.dumps(context, option=orjson.OPT_INDENT_2).decode('utf-8')
         return json.dumps(context, indent=2, ensure_ascii=False)
 
 
 # Quick test function
 def test_collector():
     """Test the context collector"""
+    arcpy = _arcpy()
     collector = ContextCollector()
     context = collector.collect_full_context()
     
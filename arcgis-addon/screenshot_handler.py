@@ -4,11 +4,114 @@ Screenshot Handler for ArcGIS AI Assistant
 Captures map screenshots and prepares them for vision analysis
 """
 
-import arcpy
 import os
 import tempfile
 from datetime import datetime
 
+import numpy as np
+from PIL import Image
+
+# arcpy takes seconds to import, so it is loaded on first use. This keeps
+# the pure-Python helpers importable (and testable) without it.
+arcpy = None
+
+
+def _arcpy():
+    """Import arcpy on first use and return the module"""
+    global arcpy
+    if arcpy is None:
+        import arcpy as arcpy_module
+        arcpy = arcpy_module
+    return arcpy
+
+
+# Vision APIs downscale anything larger than this anyway
+VISION_MAX_SIDE = 1024
+
+# Export resolution; 72 dpi is enough for a vision model and exports faster
+DEFAULT_DPI = 72
+HIGH_DPI = 96
+
+# numba takes seconds to import, so the JIT kernel is built on first use.
+# False once numba turned out to be missing; Pillow does the resize then.
+_resize_kernel = None
+
+# Replaced by numba.prange when the kernel is compiled
+prange = range
+
+
+def _bilinear_resize(src, out_h, out_w):
+    """Bilinear resize of a uint8[H, W, C] image (JIT-compiled when numba is present)"""
+    h, w, c = src.shape
+    out = np.empty((out_h, out_w, c), dtype=np.uint8)
+    scale_y = h / out_h
+    scale_x = w / out_w
+    
+    for y in prange(out_h):
+        sy = max((y + 0.5) * scale_y - 0.5, 0.0)
+        y0 = min(int(sy), h - 1)
+        y1 = min(y0 + 1, h - 1)
+        fy = sy - y0
+        
+        for x in range(out_w):
+            sx = max((x + 0.5) * scale_x - 0.5, 0.0)
+            x0 = min(int(sx), w - 1)
+            x1 = min(x0 + 1, w - 1)
+            fx = sx - x0
+            
+            for ch in range(c):
+                top = src[y0, x0, ch] * (1.0 - fx) + src[y0, x1, ch] * fx
+                bottom = src[y1, x0, ch] * (1.0 - fx) + src[y1, x1, ch] * fx
+                out[y, x, ch] = min(int(top * (1.0 - fy) + bottom * fy + 0.5), 255)
+    
+    return out
+
+
+def _get_resize_kernel():
+    """JIT-compiled _bilinear_resize, or None if numba is not installed"""
+    global _resize_kernel, prange
+    if _resize_kernel is None:
+        try:
+            from numba import njit, prange as numba_prange
+        except ImportError:  # numba is optional
+            _resize_kernel = False
+        else:
+            prange = numba_prange
+            # cache=True keeps the compiled kernel on disk, so only the first run pays for compilation
+            _resize_kernel = njit(parallel=True, cache=True)(_bilinear_resize)
+    return _resize_kernel or None
+
+
+def _resize_for_vision(path, max_side=VISION_MAX_SIDE):
+    """
+    Downscale a screenshot so that its longest side is at most max_side
+    
+    Returns:
+        str: Path to the resized PNG, or the original path if it is small enough
+    """
+    with Image.open(path) as img:
+        image = img.convert("RGB")
+    
+    width, height = image.size
+    scale = max_side / max(width, height)
+    if scale >= 1:
+        return path
+    
+    out_w = max(1, round(width * scale))
+    out_h = max(1, round(height * scale))
+    
+    kernel = _get_resize_kernel()
+    if kernel is not None:
+        pixels = np.ascontiguousarray(np.asarray(image, dtype=np.uint8))
+        resized = Image.fromarray(kernel(pixels, out_h, out_w))
+    else:
+        resized = image.resize((out_w, out_h), Image.BILINEAR)
+    
+    root, ext = os.path.splitext(path)
+    resized_path = f"{root}_{max_side}px{ext}"
+    resized.save(resized_path)
+    return resized_path
+
 
 class ScreenshotHandler:
     """Handles screenshot capture from ArcGIS Pro"""
@@ -16,17 +119,18 @@ class ScreenshotHandler:
     def __init__(self):
         self.project = None
         try:
-            self.project = arcpy.mp.ArcGISProject("CURRENT")
+            self.project = _arcpy().mp.ArcGISProject("CURRENT")
         except Exception as e:
-            arcpy.AddWarning(f"Could not access current project: {e}")
+            _arcpy().AddWarning(f"Could not access current project: {e}")
     
-    def capture_current_map(self, width=1920, height=1080):
+    def capture_current_map(self, width=1280, height=720, high_dpi=False):
         """
         Capture screenshot of the current map view
         
         Args:
             width: Screenshot width in pixels
             height: Screenshot height in pixels
+            high_dpi: Export at HIGH_DPI instead of DEFAULT_DPI
             
         Returns:
             str: Path to the captured screenshot
@@ -52,13 +156,15 @@ class ScreenshotHandler:
             # Export map to PNG
             # Note: This requires ArcGIS Pro 2.8+
             layout = None
-            for lyt in self.project.listLayouts():
-                if lyt.name == active_map.name or len(self.project.listLayouts()) == 1:
+            layouts = self.project.listLayouts()
+            for lyt in layouts:
+                if lyt.name == active_map.name or len(layouts) == 1:
                     layout = lyt
                     break
             
+            resolution = HIGH_DPI if high_dpi else DEFAULT_DPI
             if layout:
-                layout.exportToPNG(screenshot_path, resolution=96, width=width, height=height)
+                layout.exportToPNG(screenshot_path, resolution=resolution, width=width, height=height)
             else:
                 # Fallback: try to export map directly
                 arcpy.AddMessage("Creating temporary layout for export...")
@@ -67,7 +173,7 @@ class ScreenshotHandler:
                 
                 # Create a simple export using arcpy
                 # Note: This may require additional setup
-                screenshot_path = self._export_map_view(active_map, screenshot_path, width, height)
+                screenshot_path = self._export_map_view(active_map, screenshot_path, width, height, resolution)
             
             if os.path.exists(screenshot_path):
                 file_size = os.path.getsize(screenshot_path) / 1024  # KB
@@ -83,7 +189,24 @@ class ScreenshotHandler:
             arcpy.AddError(traceback.format_exc())
             return None
     
-    def _export_map_view(self, map_obj, output_path, width, height):
+    def capture_for_vision(self, width=1280, height=720, max_side=VISION_MAX_SIDE):
+        """
+        Capture the current map and downscale it for a vision model
+        
+        Returns:
+            str: Path to the resized screenshot
+        """
+        screenshot_path = self.capture_current_map(width, height)
+        if not screenshot_path:
+            return None
+        
+        try:
+            return _resize_for_vision(screenshot_path, max_side)
+        except Exception as e:
+            arcpy.AddWarning(f"Could not resize screenshot, using original: {e}")
+            return screenshot_path
+    
+    def _export_map_view(self, map_obj, output_path, width, height, resolution=DEFAULT_DPI):
         """
         Fallback method to export map view
         
@@ -106,7 +229,7 @@ class ScreenshotHandler:
                 return None
             
             # Export
-            layout.exportToPNG(output_path, resolution=96)
+            layout.exportToPNG(output_path, resolution=resolution)
             return output_path
             
         except Exception as e:
@@ -128,6 +251,7 @@ class ScreenshotHandler:
 
 def test_screenshot():
     """Test screenshot capture"""
+    arcpy = _arcpy()
     handler = ScreenshotHandler()
     
     arcpy.AddMessage("Testing screenshot capture...")
@@ -0,0 +1,68 @@
+package cache
+
+import (
+	"sync"
+	"time"
+)
+
+// Store is a concurrency-safe in-memory map whose entries expire after a
+// fixed time-to-live. Every hit extends the entry's lifetime.
+type Store[V any] struct {
+	mu      sync.Mutex
+	ttl     time.Duration
+	entries map[string]entry[V]
+	now     func() time.Time
+}
+
+type entry[V any] struct {
+	value   V
+	expires time.Time
+}
+
+// New creates an empty store with the given time-to-live
+func New[V any](ttl time.Duration) *Store[V] {
+	return &Store[V]{
+		ttl:     ttl,
+		entries: make(map[string]entry[V]),
+		now:     time.Now,
+	}
+}
+
+// Get returns the value stored under key if it has not expired yet
+func (s *Store[V]) Get(key string) (V, bool) {
+	s.mu.Lock()
+	defer s.mu.Unlock()
+
+	e, ok := s.entries[key]
+	if !ok || s.now().After(e.expires) {
+		delete(s.entries, key)
+		var zero V
+		return zero, false
+	}
+
+	e.expires = s.now().Add(s.ttl)
+	s.entries[key] = e
+	return e.value, true
+}
+
+// Put stores value under key and drops entries that have expired
+func (s *Store[V]) Put(key string, value V) {
+	s.mu.Lock()
+	defer s.mu.Unlock()
+
+	now := s.now()
+	for k, e := range s.entries {
+		if now.After(e.expires) {
+			delete(s.entries, k)
+		}
+	}
+
+	s.entries[key] = entry[V]{value: value, expires: now.Add(s.ttl)}
+}
+
+// Len returns the number of stored entries, including expired ones not yet pruned
+func (s *Store[V]) Len() int {
+	s.mu.Lock()
+	defer s.mu.Unlock()
+	return len(s.entries)
+}
@@ -0,0 +1,67 @@
+package cache
+
+import (
+	"testing"
+	"time"
+)
+
+func newTestStore(ttl time.Duration) (*Store[string], *time.Time) {
+	now := time.Date(2026, 1, 1, 12, 0, 0, 0, time.UTC)
+	s := New[string](ttl)
+	s.now = func() time.Time { return now }
+	return s, &now
+}
+
+func TestStore_PutGet(t *testing.T) {
+	s, _ := newTestStore(time.Minute)
+
+	s.Put("ctx", "layers")
+
+	value, ok := s.Get("ctx")
+	if !ok || value != "layers" {
+		t.Errorf("Expected stored value, got %q (found=%v)", value, ok)
+	}
+
+	if _, ok := s.Get("missing"); ok {
+		t.Error("Unknown key reported as found")
+	}
+}
+
+func TestStore_Expiry(t *testing.T) {
+	s, now := newTestStore(time.Minute)
+
+	s.Put("ctx", "layers")
+	*now = now.Add(2 * time.Minute)
+
+	if _, ok := s.Get("ctx"); ok {
+		t.Error("Expired entry reported as found")
+	}
+	if s.Len() != 0 {
+		t.Errorf("Expired entry not removed, len=%d", s.Len())
+	}
+}
+
+func TestStore_GetExtendsLifetime(t *testing.T) {
+	s, now := newTestStore(time.Minute)
+
+	s.Put("ctx", "layers")
+	*now = now.Add(45 * time.Second)
+	s.Get("ctx")
+	*now = now.Add(45 * time.Second)
+
+	if _, ok := s.Get("ctx"); !ok {
+		t.Error("Entry expired although it was read within its TTL")
+	}
+}
+
+func TestStore_PutPrunesExpired(t *testing.T) {
+	s, now := newTestStore(time.Minute)
+
+	s.Put("old", "a")
+	*now = now.Add(2 * time.Minute)
+	s.Put("new", "b")
+
+	if s.Len() != 1 {
+		t.Errorf("Expected only the fresh entry to remain, len=%d", s.Len())
+	}
+}
@@ -9,6 +9,7 @@ import (
 	"net/http"
 	"os"
 
+	"qgis-ai-assistant/internal/cache"
 	"qgis-ai-assistant/internal/llm"
 	"qgis-ai-assistant/internal/models"
 )
@@ -18,6 +19,7 @@ type AnalyzeScreenshotRequest struct {
 	ImagePath   string          `json:"imagePath,omitempty"`
 	Prompt      string          `json:"prompt"`
 	Context     *models.Context `json:"context,omitempty"`
+	ContextID   string          `json:"contextId,omitempty"`
 }
 
 type AnalyzeScreenshotResponse struct {
@@ -31,11 +33,13 @@ type AnalyzeScreenshotResponse struct {
 
 type AnalyzeHandler struct {
 	llmClient *llm.Client
+	contexts  *cache.Store[*models.Context]
 }
 
-func NewAnalyzeHandler(llmClient *llm.Client) *AnalyzeHandler {
+func NewAnalyzeHandler(llmClient *llm.Client, contexts *cache.Store[*models.Context]) *AnalyzeHandler {
 	return &AnalyzeHandler{
 		llmClient: llmClient,
+		contexts:  contexts,
 	}
 }
 
@@ -51,6 +55,11 @@ func (h *AnalyzeHandler) Handle(w http.ResponseWriter, r *http.Request) {
 		return
 	}
 
+	if !resolveContext(h.contexts, req.ContextID, &req.Context) {
+		writeContextNotFound(w, req.ContextID)
+		return
+	}
+
 	log.Printf("=== SCREENSHOT ANALYSIS REQUEST ===")
 	log.Printf("Prompt: %s", req.Prompt)
 	log.Printf("Has image: %v", req.ImageBase64 != "" || req.ImagePath != "")
@@ -0,0 +1,211 @@
+package handlers
+
+import (
+	"encoding/json"
+	"log"
+	"net/http"
+	"strings"
+
+	"qgis-ai-assistant/internal/cache"
+	"qgis-ai-assistant/internal/limiter"
+	"qgis-ai-assistant/internal/llm"
+	"qgis-ai-assistant/internal/models"
+	"qgis-ai-assistant/internal/validator"
+)
+
+// maxChatAttempts bounds how many failed attempts a chat request may carry
+const maxChatAttempts = 3
+
+// ChatHandler serves first attempts and fixes through one endpoint. Model
+// calls go through a shared limiter that bounds how many run at once.
+// The reply is NDJSON: {"delta": ...} lines stream the explanation of the
+// model's answer as it is generated, and the last line holds the result.
+// The code itself is only sent in the result, after it passed validation.
+type ChatHandler struct {
+	llmClient *llm.Client
+	validator *validator.Validator
+	contexts  *cache.Store[*models.Context]
+	limit     *limiter.Limiter
+}
+
+func NewChatHandler(llmClient *llm.Client, contexts *cache.Store[*models.Context], limit *limiter.Limiter) *ChatHandler {
+	return &ChatHandler{
+		llmClient: llmClient,
+		validator: validator.NewValidator(),
+		contexts:  contexts,
+		limit:     limit,
+	}
+}
+
+func (h *ChatHandler) Handle(w http.ResponseWriter, r *http.Request) {
+	if r.Method != http.MethodPost {
+		http.Error(w, "Method not allowed", http.StatusMethodNotAllowed)
+		return
+	}
+
+	var req models.ChatRequest
+	if err := json.NewDecoder(r.Body).Decode(&req); err != nil {
+		http.Error(w, "Invalid request body", http.StatusBadRequest)
+		return
+	}
+
+	if !resolveContext(h.contexts, req.ContextID, &req.Context) {
+		writeContextNotFound(w, req.ContextID)
+		return
+	}
+
+	log.Printf("=== CHAT REQUEST ===")
+	log.Printf("Prompt: %s", req.Prompt)
+	log.Printf("Attempt: %d", len(req.History)+1)
+
+	out := &ndjsonWriter{w: w}
+	if len(req.History) > maxChatAttempts {
+		out.line(http.StatusBadRequest, models.GenerateResponse{
+			Error: "Maximum retry attempts exceeded",
+		})
+		return
+	}
+
+	// The model call runs on its own goroutine and hands its chunks
+	// over a channel, so only this goroutine ever writes the response
+	ctx := r.Context()
+	deltas := make(chan string, 64)
+	var (
+		code, explanation    string
+		usedLayers, warnings []string
+		err                  error
+	)
+	go h.limit.Do(ctx, func() {
+		defer close(deltas)
+		if ctx.Err() != nil {
+			return
+		}
+		code, explanation, usedLayers, warnings, err = h.llmClient.ChatStream(ctx, req.Prompt, req.History, req.Context, func(delta string) {
+			select {
+			case deltas <- delta:
+			case <-ctx.Done():
+			}
+		})
+	})
+
+	streamed := &explanationFilter{emit: func(text string) {
+		out.line(http.StatusOK, models.ChatDelta{Delta: text})
+	}}
+stream:
+	for {
+		select {
+		case delta, ok := <-deltas:
+			if !ok {
+				break stream
+			}
+			streamed.write(delta)
+		case <-ctx.Done():
+			log.Printf("Chat request abandoned: %v", ctx.Err())
+			return
+		}
+	}
+	streamed.flush()
+
+	if err != nil {
+		log.Printf("Error generating code: %v", err)
+		out.line(http.StatusInternalServerError, models.GenerateResponse{
+			Error: err.Error(),
+		})
+		return
+	}
+
+	// SECURITY: Validate generated code
+	validationResult := h.validator.ValidateCode(code)
+	for _, err := range validationResult.Errors {
+		warnings = append(warnings, "🔒 SECURITY: "+err)
+	}
+	if !validationResult.IsValid && validationResult.Score < 50 {
+		log.Printf("⚠️ Generated code failed validation: %v", validationResult.Errors)
+		out.line(http.StatusBadRequest, models.GenerateResponse{
+			Error:    "Сгенерированный код не прошел проверку безопасности. Попробуйте переформулировать запрос.",
+			Warnings: warnings,
+		})
+		return
+	}
+	warnings = append(warnings, validationResult.Warnings...)
+
+	log.Printf("Code generated successfully (score %d)", validationResult.Score)
+
+	out.line(http.StatusOK, models.GenerateResponse{
+		Code:        code,
+		Explanation: explanation,
+		UsedLayers:  usedLayers,
+		Warnings:    warnings,
+	})
+}
+
+// explanationMarker starts the explanation in the model's answer
+const explanationMarker = "ОБЪЯСНЕНИЕ:"
+
+// explanationFilter passes on complete lines of a streamed model answer
+// from the explanation marker on, skipping code fences. Code must not reach
+// the client before it has been validated.
+type explanationFilter struct {
+	emit       func(string)
+	pending    string
+	explaining bool
+	inCode     bool
+}
+
+func (f *explanationFilter) write(text string) {
+	f.pending += text
+	for {
+		i := strings.IndexByte(f.pending, '\n')
+		if i < 0 {
+			return
+		}
+		f.line(f.pending[:i+1])
+		f.pending = f.pending[i+1:]
+	}
+}
+
+// flush handles the last line of the answer, which has no newline
+func (f *explanationFilter) flush() {
+	if f.pending != "" {
+		f.line(f.pending)
+		f.pending = ""
+	}
+}
+
+func (f *explanationFilter) line(line string) {
+	if strings.HasPrefix(strings.TrimSpace(line), "```") {
+		f.inCode = !f.inCode
+		return
+	}
+	if f.inCode {
+		return
+	}
+	if !f.explaining {
+		if !strings.Contains(strings.ToUpper(line), explanationMarker) {
+			return
+		}
+		f.explaining = true
+	}
+	f.emit(line)
+}
+
+// ndjsonWriter writes one JSON value per line and flushes each line to the
+// client right away. The status passed with the first line is the status of
+// the whole response.
+type ndjsonWriter struct {
+	w       http.ResponseWriter
+	started bool
+}
+
+func (n *ndjsonWriter) line(status int, v interface{}) {
+	if !n.started {
+		n.w.Header().Set("Content-Type", "application/x-ndjson")
+		n.w.WriteHeader(status)
+		n.started = true
+	}
+
+	json.NewEncoder(n.w).Encode(v)
+	if f, ok := n.w.(http.Flusher); ok {
+		f.Flush()
+	}
+}
@@ -0,0 +1,38 @@
+package handlers
+
+import (
+	"strings"
+	"testing"
+)
+
+func TestExplanationFilter_SkipsCode(t *testing.T) {
+	answer := "Вот ответ:\nОБЪЯСНЕНИЕ: Удаляет файл\nи больше ничего\n```python\nimport os\nos.remove('/data')\n```"
+
+	var got strings.Builder
+	f := &explanationFilter{emit: func(s string) { got.WriteString(s) }}
+	// Feed the answer in small chunks that split lines and the fence
+	for i := 0; i < len(answer); i += 5 {
+		end := i + 5
+		if end > len(answer) {
+			end = len(answer)
+		}
+		f.write(answer[i:end])
+	}
+	f.flush()
+
+	want := "ОБЪЯСНЕНИЕ: Удаляет файл\nи больше ничего\n"
+	if got.String() != want {
+		t.Errorf("Expected %q, got %q", want, got.String())
+	}
+}
+
+func TestExplanationFilter_NoExplanation(t *testing.T) {
+	var got strings.Builder
+	f := &explanationFilter{emit: func(s string) { got.WriteString(s) }}
+	f.write("arcpy.Buffer_analysis('roads', 'out', '500 Meters')\n")
+	f.flush()
+
+	if got.Len() != 0 {
+		t.Errorf("Expected nothing to be streamed, got %q", got.String())
+	}
+}
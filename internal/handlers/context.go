@@ -0,0 +1,41 @@
+package handlers
+
+import (
+	"encoding/json"
+	"fmt"
+	"net/http"
+
+	"qgis-ai-assistant/internal/cache"
+	"qgis-ai-assistant/internal/models"
+)
+
+// resolveContext remembers an uploaded context under its id, or fills in a
+// previously uploaded one when the client sent only the id. It returns false
+// when the id is unknown (never uploaded or expired).
+func resolveContext(contexts *cache.Store[*models.Context], id string, ctx **models.Context) bool {
+	if id == "" {
+		return true
+	}
+
+	if *ctx != nil {
+		contexts.Put(id, *ctx)
+		return true
+	}
+
+	cached, ok := contexts.Get(id)
+	if !ok {
+		return false
+	}
+	*ctx = cached
+	return true
+}
+
+// writeContextNotFound tells the client to resend the full context
+func writeContextNotFound(w http.ResponseWriter, id string) {
+	resp := models.GenerateResponse{
+		Error: fmt.Sprintf("Unknown contextId %q, resend the full context", id),
+	}
+	w.Header().Set("Content-Type", "application/json")
+	w.WriteHeader(http.StatusNotFound)
+	json.NewEncoder(w).Encode(resp)
+}
@@ -5,6 +5,7 @@ import (
 	"log"
 	"net/http"
 
+	"qgis-ai-assistant/internal/cache"
 	"qgis-ai-assistant/internal/llm"
 	"qgis-ai-assistant/internal/models"
 	"qgis-ai-assistant/internal/validator"
@@ -13,12 +14,16 @@ import (
 type GenerateHandler struct {
 	llmClient *llm.Client
 	validator *validator.Validator
+	contexts  *cache.Store[*models.Context]
+	responses *cache.Store[models.GenerateResponse]
 }
 
-func NewGenerateHandler(llmClient *llm.Client) *GenerateHandler {
+func NewGenerateHandler(llmClient *llm.Client, contexts *cache.Store[*models.Context], responses *cache.Store[models.GenerateResponse]) *GenerateHandler {
 	return &GenerateHandler{
 		llmClient: llmClient,
 		validator: validator.NewValidator(),
+		contexts:  contexts,
+		responses: responses,
 	}
 }
 
@@ -34,6 +39,11 @@ func (h *GenerateHandler) Handle(w http.ResponseWriter, r *http.Request) {
 		return
 	}
 
+	if !resolveContext(h.contexts, req.ContextID, &req.Context) {
+		writeContextNotFound(w, req.ContextID)
+		return
+	}
+
 	log.Printf("=== NEW REQUEST ===")
 	log.Printf("Prompt: %s", req.Prompt)
 	if req.Context != nil {
@@ -43,6 +53,19 @@ func (h *GenerateHandler) Handle(w http.ResponseWriter, r *http.Request) {
 		log.Printf("Context: Not provided (legacy mode)")
 	}
 
+	// Identical prompt against an identical context: reuse the earlier answer
+	// unless the client asks for a new one; the new answer replaces it
+	responseKey := ""
+	if req.PromptID != "" && req.ContextID != "" {
+		responseKey = req.PromptID + "/" + req.ContextID
+		if resp, ok := h.responses.Get(responseKey); ok && !req.NoCache {
+			log.Printf("Serving cached response for prompt %s", req.PromptID)
+			w.Header().Set("Content-Type", "application/json")
+			json.NewEncoder(w).Encode(resp)
+			return
+		}
+	}
+
 	code, explanation, usedLayers, warnings, err := h.llmClient.GenerateCodeWithContext(req.Prompt, req.Context)
 	if err != nil {
 		log.Printf("Error generating code: %v", err)
@@ -94,6 +117,10 @@ func (h *GenerateHandler) Handle(w http.ResponseWriter, r *http.Request) {
 		Warnings:    warnings,
 	}
 
+	if responseKey != "" {
+		h.responses.Put(responseKey, resp)
+	}
+
 	log.Printf("Code generated successfully")
 	log.Printf("Used layers: %v", usedLayers)
 	if len(warnings) > 0 {
@@ -5,17 +5,20 @@ import (
 	"log"
 	"net/http"
 
+	"qgis-ai-assistant/internal/cache"
 	"qgis-ai-assistant/internal/llm"
 	"qgis-ai-assistant/internal/models"
 )
 
 type RegenerateHandler struct {
 	llmClient *llm.Client
+	contexts  *cache.Store[*models.Context]
 }
 
-func NewRegenerateHandler(llmClient *llm.Client) *RegenerateHandler {
+func NewRegenerateHandler(llmClient *llm.Client, contexts *cache.Store[*models.Context]) *RegenerateHandler {
 	return &RegenerateHandler{
 		llmClient: llmClient,
+		contexts:  contexts,
 	}
 }
 
@@ -31,6 +34,11 @@ func (h *RegenerateHandler) Handle(w http.ResponseWriter, r *http.Request) {
 		return
 	}
 
+	if !resolveContext(h.contexts, req.ContextID, &req.Context) {
+		writeContextNotFound(w, req.ContextID)
+		return
+	}
+
 	log.Printf("=== REGENERATE REQUEST ===")
 	log.Printf("Original prompt: %s", req.OriginalPrompt)
 	log.Printf("Attempt: %d", req.Attempt)
@@ -0,0 +1,36 @@
+package limiter
+
+import (
+	"context"
+)
+
+// Limiter bounds how many jobs run at once. Each job takes one of max
+// slots and frees it as soon as it finishes, so a new job starts right
+// away whenever a slot is free instead of waiting for other jobs.
+type Limiter struct {
+	slots chan struct{}
+}
+
+// New returns a limiter that runs at most max jobs at once
+func New(max int) *Limiter {
+	if max < 1 {
+		max = 1
+	}
+	return &Limiter{
+		slots: make(chan struct{}, max),
+	}
+}
+
+// Do waits for a free slot and runs job in it. It returns ctx.Err() if ctx
+// is done before a slot frees up; a job that has started runs to the end.
+func (l *Limiter) Do(ctx context.Context, job func()) error {
+	select {
+	case l.slots <- struct{}{}:
+	case <-ctx.Done():
+		return ctx.Err()
+	}
+	defer func() { <-l.slots }()
+
+	job()
+	return nil
+}
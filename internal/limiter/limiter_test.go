@@ -0,0 +1,104 @@
+package limiter
+
+import (
+	"context"
+	"sync"
+	"sync/atomic"
+	"testing"
+	"time"
+)
+
+// holdSlot starts a job that keeps one slot of l until release is closed
+func holdSlot(l *Limiter, release chan struct{}) {
+	started := make(chan struct{})
+	go l.Do(context.Background(), func() {
+		close(started)
+		<-release
+	})
+	<-started
+}
+
+func TestLimiter_RunsJob(t *testing.T) {
+	l := New(2)
+
+	ran := false
+	if err := l.Do(context.Background(), func() { ran = true }); err != nil {
+		t.Fatalf("Do failed: %v", err)
+	}
+	if !ran {
+		t.Error("Job did not run")
+	}
+}
+
+func TestLimiter_LimitsConcurrentJobs(t *testing.T) {
+	l := New(3)
+
+	// A long job holds one slot; the others must not wait for it
+	release := make(chan struct{})
+	defer close(release)
+	holdSlot(l, release)
+
+	var running, peak int32
+	entered := make(chan struct{})
+	gate := make(chan struct{})
+	var wg sync.WaitGroup
+	for i := 0; i < 5; i++ {
+		wg.Add(1)
+		go func() {
+			defer wg.Done()
+			l.Do(context.Background(), func() {
+				n := atomic.AddInt32(&running, 1)
+				for {
+					p := atomic.LoadInt32(&peak)
+					if n <= p || atomic.CompareAndSwapInt32(&peak, p, n) {
+						break
+					}
+				}
+				entered <- struct{}{}
+				<-gate
+				atomic.AddInt32(&running, -1)
+			})
+		}()
+	}
+
+	// Both free slots are taken while the long job still runs
+	for i := 0; i < 2; i++ {
+		select {
+		case <-entered:
+		case <-time.After(time.Second):
+			t.Fatal("Jobs waited for the long running job instead of using the free slots")
+		}
+	}
+	select {
+	case <-entered:
+		t.Fatal("A job started without a free slot")
+	case <-time.After(20 * time.Millisecond):
+	}
+
+	// Let the jobs finish one by one; each freed slot admits the next job
+	go func() {
+		for range entered {
+		}
+	}()
+	close(gate)
+	wg.Wait()
+	close(entered)
+
+	if peak != 2 {
+		t.Errorf("Expected 2 jobs in the 2 free slots at once, peak was %d", peak)
+	}
+}
+
+func TestLimiter_ContextCancelled(t *testing.T) {
+	l := New(1)
+
+	release := make(chan struct{})
+	defer close(release)
+	holdSlot(l, release)
+
+	ctx, cancel := context.WithTimeout(context.Background(), 20*time.Millisecond)
+	defer cancel()
+	if err := l.Do(ctx, func() {}); err == nil {
+		t.Error("Expected an error for a cancelled context")
+	}
+}
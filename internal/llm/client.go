@@ -8,6 +8,7 @@ import (
 	"qgis-ai-assistant/internal/models"
 
 	"github.com/google/generative-ai-go/genai"
+	"google.golang.org/api/iterator"
 	"google.golang.org/api/option"
 )
 
@@ -78,6 +79,52 @@ func (c *Client) RegenerateCode(originalPrompt, failedCode, errorMessage string,
 	return code, explanation, usedLayers, warnings, nil
 }
 
+// ChatStream generates code for a prompt, or a fix for the last failed
+// attempt in history when there is one. Chunks of the model's answer are
+// passed to onDelta as they arrive; onDelta may be nil.
+func (c *Client) ChatStream(ctx context.Context, prompt string, history []models.ChatTurn, projectContext *models.Context, onDelta func(string)) (code, explanation string, usedLayers, warnings []string, err error) {
+	var fullPrompt string
+	if len(history) == 0 {
+		fullPrompt = BuildPromptWithContext(prompt, projectContext)
+	} else {
+		last := history[len(history)-1]
+		fullPrompt = BuildRegenerationPrompt(prompt, last.FailedCode, last.Error, projectContext, len(history))
+	}
+
+	var sb strings.Builder
+	iter := c.model.GenerateContentStream(ctx, genai.Text(fullPrompt))
+	for {
+		resp, err := iter.Next()
+		if err == iterator.Done {
+			break
+		}
+		if err != nil {
+			return "", "", nil, nil, fmt.Errorf("failed to stream content: %w", err)
+		}
+
+		if len(resp.Candidates) == 0 || resp.Candidates[0].Content == nil {
+			continue
+		}
+		for _, part := range resp.Candidates[0].Content.Parts {
+			text := fmt.Sprintf("%v", part)
+			sb.WriteString(text)
+			if onDelta != nil {
+				onDelta(text)
+			}
+		}
+	}
+
+	if sb.Len() == 0 {
+		return "", "", nil, nil, fmt.Errorf("empty response from Gemini")
+	}
+
+	code, explanation = ExtractCodeAndExplanation(sb.String())
+	usedLayers = ExtractUsedLayers(code, projectContext)
+	warnings = GenerateWarnings(code, projectContext)
+
+	return code, explanation, usedLayers, warnings, nil
+}
+
 // ExtractUsedLayers identifies which layers are referenced in the code
 func ExtractUsedLayers(code string, context *models.Context) []string {
 	if context == nil {
@@ -41,7 +41,9 @@ func BuildPromptWithContext(userRequest string, context *models.Context) string
 
 	systemPrompt += `
 
-ФОРМАТ ОТВЕТА:
+ФОРМАТ ОТВЕТА (сначала объяснение, затем код):
+ОБЪЯСНЕНИЕ: Краткое описание того, что делает код (на русском языке)
+
 ` + "```python" + `
 from qgis.core import *
 from qgis import processing
@@ -50,9 +52,7 @@ from qgis import processing
 # Используй QgsMessageLog.logMessage() для вывода информации
 # Пример: QgsMessageLog.logMessage("Результат", "AI Assistant", Qgis.Info)
 
-` + "```" + `
-
-ОБЪЯСНЕНИЕ: Краткое описание того, что делает код (на русском языке)`
+` + "```"
 
 	return fmt.Sprintf("%s\n\nЗАПРОС ПОЛЬЗОВАТЕЛЯ: %s", systemPrompt, userRequest)
 }
@@ -90,12 +90,12 @@ func BuildRegenerationPrompt(originalPrompt, failedCode, errorMessage string, co
 - Добавь проверки на существование данных если нужно
 - Используй QgsMessageLog.logMessage() для отладочной информации
 
-ФОРМАТ ОТВЕТА:
+ФОРМАТ ОТВЕТА (сначала объяснение, затем код):
+ОБЪЯСНЕНИЕ: Что было исправлено и почему
+
 ` + "```python" + `
 # Исправленный код
-` + "```" + `
-
-ОБЪЯСНЕНИЕ: Что было исправлено и почему`
+` + "```"
 
 	return prompt
 }
@@ -116,11 +116,20 @@ func formatContextInfo(context *models.Context) string {
 	for i, layer := range context.Layers {
 		sb.WriteString(fmt.Sprintf("\n%d. \"%s\"", i+1, layer.Name))
 
+		if layer.InView != nil && !*layer.InView {
+			sb.WriteString(" [вне видимой области, подробности не собраны]")
+			continue
+		}
+
 		if layer.GeometryType != "" {
 			sb.WriteString(fmt.Sprintf("\n   Тип: %s", layer.GeometryType))
 		}
 
-		sb.WriteString(fmt.Sprintf("\n   Объектов: %d", layer.FeatureCount))
+		if layer.FeatureCountExact != nil && !*layer.FeatureCountExact {
+			sb.WriteString("\n   Объектов: неизвестно")
+		} else {
+			sb.WriteString(fmt.Sprintf("\n   Объектов: %d", layer.FeatureCount))
+		}
 
 		if len(layer.Fields) > 0 {
 			sb.WriteString("\n   Поля: ")
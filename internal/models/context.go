@@ -1,6 +1,13 @@
 package models
 
-import "time"
+import (
+	"bytes"
+	"encoding/json"
+	"time"
+)
+
+// FieldsSchemaSoA marks contexts whose layer fields are sent column-wise
+const FieldsSchemaSoA = "soa-v1"
 
 // Context represents the full ArcGIS project context
 type Context struct {
@@ -8,6 +15,7 @@ type Context struct {
 	Layers      []LayerInfo `json:"layers"`
 	ActiveLayer string      `json:"activeLayer,omitempty"`
 	MapExtent   *MapExtent  `json:"mapExtent,omitempty"`
+	Schema      string      `json:"schema,omitempty"`
 	Timestamp   time.Time   `json:"timestamp"`
 }
 
@@ -19,18 +27,23 @@ type ProjectInfo struct {
 	DefaultDatabase  string `json:"defaultDatabase,omitempty"`
 }
 
-// LayerInfo contains detailed layer metadata
+// LayerInfo contains detailed layer metadata. FeatureCountExact is set to
+// false when the client could not count the features in time; FeatureCount
+// carries no information then. InView is set to false for layers outside the
+// visible map area, which are described only by name and type.
 type LayerInfo struct {
-	Name             string       `json:"name"`
-	Type             string       `json:"type"`
-	GeometryType     string       `json:"geometryType,omitempty"`
-	FeatureCount     int          `json:"featureCount"`
-	DataSource       string       `json:"dataSource,omitempty"`
-	Fields           []FieldInfo  `json:"fields,omitempty"`
-	SpatialReference string       `json:"spatialReference"`
-	Extent           *LayerExtent `json:"extent,omitempty"`
-	IsVisible        bool         `json:"isVisible"`
-	IsEditable       bool         `json:"isEditable"`
+	Name              string       `json:"name"`
+	Type              string       `json:"type"`
+	GeometryType      string       `json:"geometryType,omitempty"`
+	FeatureCount      int          `json:"featureCount"`
+	FeatureCountExact *bool        `json:"featureCountExact,omitempty"`
+	DataSource        string       `json:"dataSource,omitempty"`
+	Fields            FieldList    `json:"fields,omitempty"`
+	SpatialReference  string       `json:"spatialReference"`
+	Extent            *LayerExtent `json:"extent,omitempty"`
+	IsVisible         bool         `json:"isVisible"`
+	IsEditable        bool         `json:"isEditable"`
+	InView            *bool        `json:"inView,omitempty"`
 }
 
 // FieldInfo describes a field in a layer
@@ -42,6 +55,54 @@ type FieldInfo struct {
 	Nullable bool   `json:"nullable"`
 }
 
+// FieldList holds the fields of a layer. It decodes both the row form
+// (an array of field objects) and the column form used by FieldsSchemaSoA
+// (an object of parallel arrays).
+type FieldList []FieldInfo
+
+type fieldColumns struct {
+	Names     []string `json:"names"`
+	Types     []string `json:"types"`
+	Aliases   []string `json:"aliases"`
+	Lengths   []int    `json:"lengths"`
+	Nullables []bool   `json:"nullables"`
+}
+
+func (f *FieldList) UnmarshalJSON(data []byte) error {
+	if trimmed := bytes.TrimSpace(data); len(trimmed) == 0 || trimmed[0] != '{' {
+		var rows []FieldInfo
+		if err := json.Unmarshal(data, &rows); err != nil {
+			return err
+		}
+		*f = rows
+		return nil
+	}
+
+	var cols fieldColumns
+	if err := json.Unmarshal(data, &cols); err != nil {
+		return err
+	}
+
+	fields := make(FieldList, len(cols.Names))
+	for i, name := range cols.Names {
+		fields[i].Name = name
+		if i < len(cols.Types) {
+			fields[i].Type = cols.Types[i]
+		}
+		if i < len(cols.Aliases) {
+			fields[i].Alias = cols.Aliases[i]
+		}
+		if i < len(cols.Lengths) {
+			fields[i].Length = cols.Lengths[i]
+		}
+		if i < len(cols.Nullables) {
+			fields[i].Nullable = cols.Nullables[i]
+		}
+	}
+	*f = fields
+	return nil
+}
+
 // LayerExtent defines spatial bounds of a layer
 type LayerExtent struct {
 	XMin float64 `json:"xMin"`
@@ -59,10 +120,15 @@ type MapExtent struct {
 	Scale float64 `json:"scale,omitempty"`
 }
 
-// GenerateRequest is the request structure for code generation
+// GenerateRequest is the request structure for code generation. NoCache
+// asks for a fresh answer even if one is cached for the same prompt and
+// context, e.g. after the user rejected that answer.
 type GenerateRequest struct {
-	Prompt  string   `json:"prompt"`
-	Context *Context `json:"context,omitempty"`
+	Prompt    string   `json:"prompt"`
+	PromptID  string   `json:"promptId,omitempty"`
+	Context   *Context `json:"context,omitempty"`
+	ContextID string   `json:"contextId,omitempty"`
+	NoCache   bool     `json:"noCache,omitempty"`
 }
 
 // GenerateResponse is the response structure
@@ -80,5 +146,28 @@ type RegenerateRequest struct {
 	FailedCode     string   `json:"failedCode"`
 	ErrorMessage   string   `json:"errorMessage"`
 	Context        *Context `json:"context,omitempty"`
+	ContextID      string   `json:"contextId,omitempty"`
 	Attempt        int      `json:"attempt"`
 }
+
+// ChatRequest asks for code for a prompt. History lists the earlier
+// attempts for the same prompt that failed, oldest first; an empty history
+// asks for a first attempt.
+type ChatRequest struct {
+	Prompt    string     `json:"prompt"`
+	Context   *Context   `json:"context,omitempty"`
+	ContextID string     `json:"contextId,omitempty"`
+	History   []ChatTurn `json:"history,omitempty"`
+}
+
+// ChatTurn is one failed attempt: the code that ran and the error it raised
+type ChatTurn struct {
+	FailedCode string `json:"failedCode"`
+	Error      string `json:"error"`
+}
+
+// ChatDelta is a progress line of a streamed chat reply: the next chunk of
+// the model's answer
+type ChatDelta struct {
+	Delta string `json:"delta"`
+}
@@ -0,0 +1,58 @@
+package models
+
+import (
+	"encoding/json"
+	"testing"
+)
+
+func TestFieldList_Rows(t *testing.T) {
+	var layer LayerInfo
+	data := `{"name": "Schools", "fields": [{"name": "NAME", "type": "String", "length": 50, "nullable": true}]}`
+
+	if err := json.Unmarshal([]byte(data), &layer); err != nil {
+		t.Fatalf("Failed to decode row fields: %v", err)
+	}
+
+	if len(layer.Fields) != 1 || layer.Fields[0].Name != "NAME" || layer.Fields[0].Length != 50 {
+		t.Errorf("Unexpected fields: %+v", layer.Fields)
+	}
+}
+
+func TestFieldList_Columns(t *testing.T) {
+	var layer LayerInfo
+	data := `{"name": "Schools", "fields": {
+		"names": ["NAME", "CAPACITY"],
+		"types": ["String", "Integer"],
+		"aliases": ["Название", "CAPACITY"],
+		"lengths": [50, 4],
+		"nullables": [true, false]
+	}}`
+
+	if err := json.Unmarshal([]byte(data), &layer); err != nil {
+		t.Fatalf("Failed to decode column fields: %v", err)
+	}
+
+	if len(layer.Fields) != 2 {
+		t.Fatalf("Expected 2 fields, got %d", len(layer.Fields))
+	}
+
+	want := FieldInfo{Name: "CAPACITY", Type: "Integer", Alias: "CAPACITY", Length: 4, Nullable: false}
+	if layer.Fields[1] != want {
+		t.Errorf("Expected %+v, got %+v", want, layer.Fields[1])
+	}
+	if layer.Fields[0].Alias != "Название" || !layer.Fields[0].Nullable {
+		t.Errorf("Unexpected first field: %+v", layer.Fields[0])
+	}
+}
+
+func TestFieldList_ShortColumns(t *testing.T) {
+	var fields FieldList
+
+	if err := json.Unmarshal([]byte(`{"names": ["A", "B"], "types": ["String"]}`), &fields); err != nil {
+		t.Fatalf("Failed to decode: %v", err)
+	}
+
+	if len(fields) != 2 || fields[1].Name != "B" || fields[1].Type != "" {
+		t.Errorf("Unexpected fields: %+v", fields)
+	}
+}
@@ -1,15 +1,26 @@
 package server
 
 import (
+	"compress/gzip"
 	"context"
 	"log"
 	"net/http"
+	"strings"
 	"time"
 
+	"qgis-ai-assistant/internal/cache"
 	"qgis-ai-assistant/internal/handlers"
+	"qgis-ai-assistant/internal/limiter"
 	"qgis-ai-assistant/internal/llm"
+	"qgis-ai-assistant/internal/models"
 )
 
+// How long uploaded contexts and generated answers are kept for reuse
+const cacheTTL = 30 * time.Minute
+
+// Most chat requests sent to the model at once
+const maxConcurrentChats = 8
+
 type Server struct {
 	httpServer *http.Server
 	llmClient  *llm.Client
@@ -20,16 +31,23 @@ func New(port string, llmClient *llm.Client) *Server {
 
 	mux.HandleFunc("/api/echo", corsMiddleware(handlers.EchoHandler))
 
-	generateHandler := handlers.NewGenerateHandler(llmClient)
-	mux.HandleFunc("/api/generate", corsMiddleware(generateHandler.Handle))
+	// Clients upload a context once and then refer to it by contextId
+	contexts := cache.New[*models.Context](cacheTTL)
+	responses := cache.New[models.GenerateResponse](cacheTTL)
+
+	generateHandler := handlers.NewGenerateHandler(llmClient, contexts, responses)
+	mux.HandleFunc("/api/generate", corsMiddleware(gzipMiddleware(generateHandler.Handle)))
 
-	regenerateHandler := handlers.NewRegenerateHandler(llmClient)
-	mux.HandleFunc("/api/regenerate", corsMiddleware(regenerateHandler.Handle))
+	regenerateHandler := handlers.NewRegenerateHandler(llmClient, contexts)
+	mux.HandleFunc("/api/regenerate", corsMiddleware(gzipMiddleware(regenerateHandler.Handle)))
+
+	chatHandler := handlers.NewChatHandler(llmClient, contexts, limiter.New(maxConcurrentChats))
+	mux.HandleFunc("/api/chat", corsMiddleware(gzipMiddleware(chatHandler.Handle)))
 
 	mux.HandleFunc("/api/validate", corsMiddleware(handlers.ValidateHandler))
 
-	analyzeHandler := handlers.NewAnalyzeHandler(llmClient)
-	mux.HandleFunc("/api/analyze-screenshot", corsMiddleware(analyzeHandler.Handle))
+	analyzeHandler := handlers.NewAnalyzeHandler(llmClient, contexts)
+	mux.HandleFunc("/api/analyze-screenshot", corsMiddleware(gzipMiddleware(analyzeHandler.Handle)))
 
 	// Data fetching endpoints
 	dataSearchHandler := handlers.NewDataSearchHandler(llmClient)
@@ -68,9 +86,11 @@ func corsMiddleware(next http.HandlerFunc) http.HandlerFunc {
 	return func(w http.ResponseWriter, r *http.Request) {
 		w.Header().Set("Access-Control-Allow-Origin", "*")
 		w.Header().Set("Access-Control-Allow-Methods", "GET, POST, PUT, DELETE, OPTIONS")
-		w.Header().Set("Access-Control-Allow-Headers", "Content-Type, Authorization")
+		w.Header().Set("Access-Control-Allow-Headers", "Content-Type, Content-Encoding, Authorization")
 
 		if r.Method == http.MethodOptions {
+			// Tell clients they may gzip large request bodies (RFC 7694)
+			w.Header().Set("Accept-Encoding", "gzip")
 			w.WriteHeader(http.StatusOK)
 			return
 		}
@@ -78,3 +98,94 @@ func corsMiddleware(next http.HandlerFunc) http.HandlerFunc {
 		next(w, r)
 	}
 }
+
+// gzipRequestMiddleware transparently decompresses gzip-encoded request bodies
+func gzipRequestMiddleware(next http.HandlerFunc) http.HandlerFunc {
+	return func(w http.ResponseWriter, r *http.Request) {
+		if r.Header.Get("Content-Encoding") != "gzip" {
+			next(w, r)
+			return
+		}
+
+		body, err := gzip.NewReader(r.Body)
+		if err != nil {
+			http.Error(w, "Invalid gzip request body", http.StatusBadRequest)
+			return
+		}
+		defer body.Close()
+
+		r.Body = body
+		r.Header.Del("Content-Encoding")
+		r.ContentLength = -1
+		next(w, r)
+	}
+}
+
+// gzipMiddleware accepts gzip-encoded request bodies and compresses the
+// response for clients that advertise gzip support
+func gzipMiddleware(next http.HandlerFunc) http.HandlerFunc {
+	return gzipResponseMiddleware(gzipRequestMiddleware(next))
+}
+
+// gzipResponseMiddleware compresses the response body when the client sent
+// "Accept-Encoding: gzip"
+func gzipResponseMiddleware(next http.HandlerFunc) http.HandlerFunc {
+	return func(w http.ResponseWriter, r *http.Request) {
+		w.Header().Add("Vary", "Accept-Encoding")
+		if !acceptsGzip(r) {
+			next(w, r)
+			return
+		}
+
+		w.Header().Set("Content-Encoding", "gzip")
+		gw := &gzipResponseWriter{ResponseWriter: w}
+		defer gw.Close()
+		next(gw, r)
+	}
+}
+
+func acceptsGzip(r *http.Request) bool {
+	for _, enc := range strings.Split(r.Header.Get("Accept-Encoding"), ",") {
+		if strings.TrimSpace(strings.SplitN(enc, ";", 2)[0]) == "gzip" {
+			return true
+		}
+	}
+	return false
+}
+
+// gzipResponseWriter compresses everything written to it. The gzip stream is
+// started on the first Write, so bodiless responses stay empty.
+type gzipResponseWriter struct {
+	http.ResponseWriter
+	zw *gzip.Writer
+}
+
+func (g *gzipResponseWriter) WriteHeader(status int) {
+	g.Header().Del("Content-Length")
+	g.ResponseWriter.WriteHeader(status)
+}
+
+func (g *gzipResponseWriter) Write(p []byte) (int, error) {
+	if g.zw == nil {
+		g.Header().Del("Content-Length")
+		g.zw = gzip.NewWriter(g.ResponseWriter)
+	}
+	return g.zw.Write(p)
+}
+
+// Flush pushes the compressed bytes written so far to the client
+func (g *gzipResponseWriter) Flush() {
+	if g.zw != nil {
+		g.zw.Flush()
+	}
+	if f, ok := g.ResponseWriter.(http.Flusher); ok {
+		f.Flush()
+	}
+}
+
+func (g *gzipResponseWriter) Close() error {
+	if g.zw == nil {
+		return nil
+	}
+	return g.zw.Close()
+}
@@ -0,0 +1,64 @@
+package server
+
+import (
+	"bytes"
+	"compress/gzip"
+	"io"
+	"net/http"
+	"net/http/httptest"
+	"testing"
+)
+
+func echoBody(w http.ResponseWriter, r *http.Request) {
+	body, _ := io.ReadAll(r.Body)
+	w.Header().Set("Content-Type", "application/json")
+	w.Write(body)
+}
+
+func TestGzipMiddleware_RoundTrip(t *testing.T) {
+	payload := []byte(`{"prompt": "Создай буфер 100 м вокруг школ"}`)
+
+	var compressed bytes.Buffer
+	zw := gzip.NewWriter(&compressed)
+	zw.Write(payload)
+	zw.Close()
+
+	req := httptest.NewRequest(http.MethodPost, "/api/generate", &compressed)
+	req.Header.Set("Content-Encoding", "gzip")
+	req.Header.Set("Accept-Encoding", "deflate, gzip;q=0.9")
+	rec := httptest.NewRecorder()
+
+	gzipMiddleware(echoBody)(rec, req)
+
+	if rec.Header().Get("Content-Encoding") != "gzip" {
+		t.Fatalf("Expected a gzip response, got headers %v", rec.Header())
+	}
+
+	zr, err := gzip.NewReader(rec.Body)
+	if err != nil {
+		t.Fatalf("Response is not gzip: %v", err)
+	}
+	got, err := io.ReadAll(zr)
+	if err != nil {
+		t.Fatalf("Failed to read response: %v", err)
+	}
+	if !bytes.Equal(got, payload) {
+		t.Errorf("Expected %q, got %q", payload, got)
+	}
+}
+
+func TestGzipMiddleware_Identity(t *testing.T) {
+	payload := []byte(`{"prompt": "test"}`)
+
+	req := httptest.NewRequest(http.MethodPost, "/api/generate", bytes.NewReader(payload))
+	rec := httptest.NewRecorder()
+
+	gzipMiddleware(echoBody)(rec, req)
+
+	if enc := rec.Header().Get("Content-Encoding"); enc != "" {
+		t.Errorf("Expected an uncompressed response, got Content-Encoding %q", enc)
+	}
+	if !bytes.Equal(rec.Body.Bytes(), payload) {
+		t.Errorf("Expected %q, got %q", payload, rec.Body.Bytes())
+	}
+}
@@ -5,16 +5,60 @@ Autonomous GIS Engineer for QGIS powered by Gemini AI
 """
 
 import os
+import hashlib
 import json
-import urllib.request
-import urllib.error
-from qgis.PyQt.QtCore import QSettings, QTranslator, QCoreApplication, Qt
+import traceback
+import requests
+from functools import lru_cache
+import qgis
+from qgis.PyQt.QtCore import QSettings, QTranslator, QCoreApplication, Qt, QEventLoop
 from qgis.PyQt.QtGui import QIcon
 from qgis.PyQt.QtWidgets import QAction, QInputDialog, QMessageBox
-from qgis.core import QgsMessageLog, Qgis, QgsProject
+from qgis.core import QgsMessageLog, Qgis, QgsApplication, QgsTask
+from qgis import core as qgis_core
+from qgis import processing
 from .context_collector import ContextCollector
 
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the stdlib encoder
+    orjson = None
+
 SERVER_URL = "http://localhost:8080"
+CHAT_URL = f"{SERVER_URL}/api/chat"
+REQUEST_TIMEOUT = (3, 60)  # connect, read (seconds)
+MAX_FIX_ATTEMPTS = 3
+# Messages below this Qgis.MessageLevel are dropped (QSettings, default: Info)
+LOG_LEVEL_SETTING = "AIAssistant/logLevel"
+
+# Every Qgs* name of qgis.core, made available to generated code
+_QGS_GLOBALS = {name: value for name, value in vars(qgis_core).items() if name.startswith('Qgs')}
+
+
+def _dumps(obj):
+    """Serialize obj to UTF-8 encoded JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+
+def _loads(data):
+    """Parse UTF-8 encoded JSON bytes"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data.decode('utf-8'))
+
+
+@lru_cache(maxsize=64)
+def _compile(source):
+    """Compile generated code; the same source is only compiled once"""
+    return compile(source, '<ai-generated>', 'exec')
+
+
+def _context_id(context):
+    """Stable id of a context snapshot; the collection timestamp is not part of it"""
+    body = _dumps({k: v for k, v in context.items() if k != 'timestamp'})
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
 
 
 class AIAssistant:
@@ -49,6 +93,21 @@ class AIAssistant:
         
         # Context collector
         self.context_collector = ContextCollector()
+        
+        # Info messages are queued and written to the log panel in one go
+        self._log_buffer = []
+        self._min_log_level = QSettings().value(LOG_LEVEL_SETTING, int(Qgis.Info), type=int)
+        
+        # Ids of contexts the server already has; those are sent by id only
+        self._known_contexts = set()
+        
+        # One keep-alive connection to the server for all requests; responses
+        # may come back gzip-compressed and are decoded transparently
+        self._session = requests.Session()
+        self._session.headers.update({
+            'Content-Type': 'application/json; charset=utf-8',
+            'Accept-Encoding': 'gzip'
+        })
 
     def tr(self, message):
         """Get the translation for a string using Qt translation API."""
@@ -124,9 +183,51 @@ class AIAssistant:
                 action)
             self.iface.removeToolBarIcon(action)
 
+        self.context_collector.disconnect_signals()
+        self._session.close()
+
     def run(self):
         """Run method that performs all the real work"""
         
+        # The UI stays live while waiting for the server, so block re-entry
+        for action in self.actions:
+            action.setEnabled(False)
+        try:
+            self._run()
+        finally:
+            self._flush_log()
+            for action in self.actions:
+                action.setEnabled(True)
+
+    def _log_enabled(self, level):
+        """Whether messages of this level reach the log panel"""
+        return int(level) >= self._min_log_level
+
+    def _log(self, level, fmt, *args):
+        """Log fmt % args; nothing is formatted when the level is filtered out.
+        
+        Info messages are queued until the next flush, other levels are written at once.
+        """
+        if not self._log_enabled(level):
+            return
+        message = fmt % args if args else fmt
+        
+        if level == Qgis.Info:
+            self._log_buffer.append(message)
+            return
+        
+        self._flush_log()
+        QgsMessageLog.logMessage(message, "AI Assistant", level)
+
+    def _flush_log(self):
+        """Write queued info messages with a single logMessage call"""
+        if self._log_buffer:
+            QgsMessageLog.logMessage("\n".join(self._log_buffer), "AI Assistant", Qgis.Info)
+            self._log_buffer.clear()
+
+    def _run(self):
+        """Ask for a command, generate code for it and execute it"""
+        
         # Get user input
         text, ok = QInputDialog.getText(
             self.iface.mainWindow(),
@@ -139,57 +240,56 @@ class AIAssistant:
         if not ok or not text:
             return
             
-        QgsMessageLog.logMessage("=" * 60, "AI Assistant", Qgis.Info)
-        QgsMessageLog.logMessage(f"Запрос: {text}", "AI Assistant", Qgis.Info)
-        QgsMessageLog.logMessage("=" * 60, "AI Assistant", Qgis.Info)
+        self._log(Qgis.Info, "=" * 60)
+        self._log(Qgis.Info, "Запрос: %s", text)
+        self._log(Qgis.Info, "=" * 60)
         
         # Collect context
-        QgsMessageLog.logMessage("Сбор контекста проекта...", "AI Assistant", Qgis.Info)
+        self._log(Qgis.Info, "Сбор контекста проекта...")
         context = self.context_collector.collect_full_context()
         
         # Show context summary
-        QgsMessageLog.logMessage(f"Проект: {context['project']['name']}", "AI Assistant", Qgis.Info)
-        QgsMessageLog.logMessage(f"Доступно слоев: {len(context['layers'])}", "AI Assistant", Qgis.Info)
+        self._log(Qgis.Info, "Проект: %s", context['project']['name'])
+        self._log(Qgis.Info, "Доступно слоев: %d", len(context['layers']))
         
         for i, layer in enumerate(context['layers'][:5]):  # Show first 5
             geom_type = layer.get('geometryType', 'N/A')
-            count = layer.get('featureCount', 0)
-            QgsMessageLog.logMessage(
-                f"  - {layer['name']} ({geom_type}, {count} объектов)",
-                "AI Assistant",
-                Qgis.Info
-            )
+            count = layer.get('featureCount')
+            if count is None:
+                count = '?'
+            self._log(Qgis.Info, "  - %s (%s, %s объектов)", layer['name'], geom_type, count)
         
         if len(context['layers']) > 5:
-            QgsMessageLog.logMessage(
-                f"  ... и еще {len(context['layers']) - 5} слоев",
-                "AI Assistant",
-                Qgis.Info
-            )
+            self._log(Qgis.Info, "  ... и еще %d слоев", len(context['layers']) - 5)
         
-        QgsMessageLog.logMessage("\nОтправка запроса в AI...", "AI Assistant", Qgis.Info)
+        # Only a compact copy of the context goes over the wire
+        context = self.context_collector.summarize_for_prompt(context)
+        context_id = _context_id(context)
+        
+        self._log(Qgis.Info, "\nОтправка запроса в AI...")
         
         # Send to AI
         try:
-            code, explanation, warnings = self.send_to_ai(text, context)
+            code, explanation, warnings = self.send_to_ai(text, context, context_id)
             
             if code:
-                QgsMessageLog.logMessage("\n" + "=" * 60, "AI Assistant", Qgis.Info)
-                QgsMessageLog.logMessage("AI ОТВЕТ:", "AI Assistant", Qgis.Info)
-                QgsMessageLog.logMessage("=" * 60, "AI Assistant", Qgis.Info)
-                QgsMessageLog.logMessage(f"Объяснение: {explanation}", "AI Assistant", Qgis.Info)
+                # The explanation was streamed to the log while it was generated
+                self._log(Qgis.Info, "\n" + "=" * 60)
+                self._log(Qgis.Info, "AI ОТВЕТ:")
+                self._log(Qgis.Info, "=" * 60)
                 
                 # Show warnings
                 if warnings:
                     for warning in warnings:
-                        QgsMessageLog.logMessage(f"⚠️ {warning}", "AI Assistant", Qgis.Warning)
+                        self._log(Qgis.Warning, "⚠️ %s", warning)
                 
-                QgsMessageLog.logMessage("\nГенерированный код:", "AI Assistant", Qgis.Info)
-                QgsMessageLog.logMessage("-" * 60, "AI Assistant", Qgis.Info)
-                QgsMessageLog.logMessage(code, "AI Assistant", Qgis.Info)
-                QgsMessageLog.logMessage("-" * 60, "AI Assistant", Qgis.Info)
+                self._log(Qgis.Info, "\nГенерированный код:")
+                self._log(Qgis.Info, "-" * 60)
+                self._log(Qgis.Info, "%s", code)
+                self._log(Qgis.Info, "-" * 60)
                 
                 # Ask for confirmation
+                self._flush_log()
                 reply = QMessageBox.question(
                     self.iface.mainWindow(),
                     "Подтверждение выполнения",
@@ -199,114 +299,172 @@ class AIAssistant:
                 )
                 
                 if reply == QMessageBox.Yes:
-                    QgsMessageLog.logMessage("\nВыполнение кода...", "AI Assistant", Qgis.Info)
-                    self.execute_code(code, text, context)
+                    self._log(Qgis.Info, "\nВыполнение кода...")
+                    self.execute_code(code, text, context, context_id)
                 else:
-                    QgsMessageLog.logMessage("Выполнение отменено пользователем", "AI Assistant", Qgis.Info)
+                    self._log(Qgis.Info, "Выполнение отменено пользователем")
             else:
-                QgsMessageLog.logMessage("❌ Не удалось получить код от AI", "AI Assistant", Qgis.Critical)
+                self._log(Qgis.Critical, "❌ Не удалось получить код от AI")
                 
         except Exception as e:
-            QgsMessageLog.logMessage(f"❌ Критическая ошибка: {str(e)}", "AI Assistant", Qgis.Critical)
-            import traceback
-            QgsMessageLog.logMessage(traceback.format_exc(), "AI Assistant", Qgis.Critical)
+            self._log(Qgis.Critical, "❌ Критическая ошибка: %s", e)
+            if self._log_enabled(Qgis.Critical):
+                self._log(Qgis.Critical, "%s", traceback.format_exc())
 
-    def execute_code(self, code, original_prompt, context):
-        """Execute generated PyQGIS code safely"""
-        try:
-            # Prepare execution environment
-            from qgis.core import *
-            from qgis import processing
-            
-            exec_globals = {
-                'qgis': __import__('qgis'),
-                'processing': processing,
-                'QgsProject': QgsProject,
-                'QgsMessageLog': QgsMessageLog,
-                'Qgis': Qgis,
-                'iface': self.iface,
-                '__builtins__': __builtins__
-            }
+    def execute_code(self, code, original_prompt, context, context_id):
+        """Execute generated PyQGIS code, asking the AI for a fix after each failure"""
+        # Prepare execution environment, shared by all attempts
+        exec_globals = {
+            **_QGS_GLOBALS,
+            'qgis': qgis,
+            'processing': processing,
+            'Qgis': Qgis,
+            'iface': self.iface,
+            '__builtins__': __builtins__
+        }
             
-            # Import all from qgis.core
-            from qgis.core import *
-            for name in dir():
-                if name.startswith('Qgs'):
-                    exec_globals[name] = eval(name)
+        history = []
+        for attempt in range(MAX_FIX_ATTEMPTS + 1):
+            if attempt:
+                self._log(Qgis.Info, "\nПопытка исправления ошибки (%d/%d)...", attempt, MAX_FIX_ATTEMPTS)
+                code = self.regenerate_code(original_prompt, history, context, context_id)
+                if not code:
+                    break
+                self._log(Qgis.Info, "AI исправил код. Повторная попытка...")
             
-            # Execute code
-            exec(code, exec_globals)
+            try:
+                # Execute code; its own log output must come after ours
+                self._flush_log()
+                exec(_compile(code), exec_globals)
+            except Exception as e:
+                error_msg = str(e)
+                self._log(Qgis.Critical, "❌ Ошибка выполнения: %s", error_msg)
+                history.append({"failedCode": code, "error": error_msg})
+                continue
             
-            QgsMessageLog.logMessage("\n✅ Код успешно выполнен!", "AI Assistant", Qgis.Success)
+            message = "Исправленный код выполнен успешно!" if attempt else "Код успешно выполнен!"
+            self._log(Qgis.Success, "\n✅ %s", message)
             self.iface.messageBar().pushMessage(
                 "AI Assistant",
-                "Код успешно выполнен!",
+                message,
                 level=Qgis.Success,
                 duration=5
             )
+            return
             
-        except Exception as e:
-            error_msg = str(e)
-            QgsMessageLog.logMessage(f"❌ Ошибка выполнения: {error_msg}", "AI Assistant", Qgis.Critical)
-            
-            # Try to regenerate
-            QgsMessageLog.logMessage("\nПопытка исправления ошибки...", "AI Assistant", Qgis.Info)
-            fixed_code = self.regenerate_code(original_prompt, code, error_msg, context)
+        if len(history) > MAX_FIX_ATTEMPTS:
+            self._log(Qgis.Critical, "Превышено максимальное количество попыток исправления")
+        self.iface.messageBar().pushMessage(
+            "AI Assistant",
+            f"Ошибка выполнения: {history[-1]['error']}",
+            level=Qgis.Critical,
+            duration=10
+        )
+
+    def _run_in_background(self, description, function, *args):
+        """Run function(*args) in a QgsTask and return its result.
+        
+        A local event loop spins until the task finishes, so QGIS keeps
+        repainting and handling input instead of freezing for the whole
+        request. Exceptions raised by function are re-raised here.
+        """
+        # Everything logged so far should be visible while we wait
+        self._flush_log()
+        
+        outcome = {}
+        loop = QEventLoop()
+        
+        def on_finished(exception, result=None):
+            outcome['exception'] = exception
+            outcome['result'] = result
+            loop.quit()
+        
+        task = QgsTask.fromFunction(description, lambda task: function(*args), on_finished=on_finished)
+        QgsApplication.taskManager().addTask(task)
+        if not outcome:
+            loop.exec_()
+        
+        if outcome.get('exception') is not None:
+            raise outcome['exception']
+        return outcome.get('result')
+
+    def _post_chat(self, payload, context):
+        """POST payload to the chat endpoint, uploading context only when needed (runs in a task)
+        
+        The context is referred to by payload["contextId"]. It is sent in
+        full the first time, and again if the server no longer knows the id
+        (restart or expiry), which it reports with 404.
+        """
+        context_id = payload["contextId"]
+        status = 404
+        if context_id in self._known_contexts:
+            status, result = self._stream_chat(payload)
+        if status == 404:
+            status, result = self._stream_chat(dict(payload, context=context))
+        
+        if status < 400:
+            self._known_contexts.add(context_id)
+        return result
+
+    def _stream_chat(self, payload):
+        """POST payload to the chat endpoint, return (status, result line of the NDJSON reply)
+        
+        The server streams the explanation of the model's answer as
+        {"delta": ...} lines before the result; complete lines of it are
+        shown in the log as they arrive. Code only comes with the result,
+        once the server has validated it.
+        """
+        response = self._session.post(CHAT_URL, data=_dumps(payload), timeout=REQUEST_TIMEOUT, stream=True)
+        
+        result = {}
+        pending = ""
+        for line in response.iter_lines():
+            if not line:
+                continue
+            message = _loads(line)
+            if 'delta' not in message:
+                result = message
+                continue
             
-            if fixed_code:
-                QgsMessageLog.logMessage("AI исправил код. Повторная попытка...", "AI Assistant", Qgis.Info)
-                try:
-                    exec(fixed_code, exec_globals)
-                    QgsMessageLog.logMessage("✅ Исправленный код выполнен успешно!", "AI Assistant", Qgis.Success)
-                    self.iface.messageBar().pushMessage(
-                        "AI Assistant",
-                        "Исправленный код выполнен успешно!",
-                        level=Qgis.Success,
-                        duration=5
-                    )
-                except Exception as e2:
-                    QgsMessageLog.logMessage(f"❌ Ошибка повторного выполнения: {str(e2)}", "AI Assistant", Qgis.Critical)
-                    self.iface.messageBar().pushMessage(
-                        "AI Assistant",
-                        f"Ошибка выполнения: {str(e2)}",
-                        level=Qgis.Critical,
-                        duration=10
-                    )
-
-    def send_to_ai(self, prompt, context):
+            pending += message['delta']
+            *complete, pending = pending.split("\n")
+            for text in complete:
+                self._log_stream_line(text)
+        
+        if pending:
+            self._log_stream_line(pending)
+        return response.status_code, result
+
+    def _log_stream_line(self, text):
+        """Show one line of the answer that is still being generated (thread-safe)"""
+        if not self._log_enabled(Qgis.Info):
+            return
+        QgsMessageLog.logMessage(f"  │ {text}", "AI Assistant", Qgis.Info)
+
+    def send_to_ai(self, prompt, context, context_id):
         """Send request to AI backend with full context"""
         try:
-            url = f"{SERVER_URL}/api/generate"
-            
             payload = {
                 "prompt": prompt,
-                "context": context
+                "contextId": context_id
             }
             
-            data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            result = self._run_in_background("AI Assistant: генерация кода", self._post_chat, payload, context)
             
-            req = urllib.request.Request(
-                url,
-                data=data,
-                headers={'Content-Type': 'application/json; charset=utf-8'}
-            )
+            error = result.get('error')
+            if error:
+                self._log(Qgis.Critical, "AI Error: %s", error)
+                return None, None, None
             
-            with urllib.request.urlopen(req, timeout=60) as response:
-                result = json.loads(response.read().decode('utf-8'))
-                
-                if 'error' in result and result['error']:
-                    QgsMessageLog.logMessage(f"AI Error: {result['error']}", "AI Assistant", Qgis.Critical)
-                    return None, None, None
-                
-                return (
-                    result.get('code'),
-                    result.get('explanation'),
-                    result.get('warnings', [])
-                )
+            return (
+                result.get('code'),
+                result.get('explanation'),
+                result.get('warnings', [])
+            )
                 
-        except urllib.error.URLError as e:
-            QgsMessageLog.logMessage(f"❌ Ошибка подключения к серверу: {str(e)}", "AI Assistant", Qgis.Critical)
-            QgsMessageLog.logMessage(f"Убедитесь, что сервер запущен на {SERVER_URL}", "AI Assistant", Qgis.Critical)
+        except requests.ConnectionError as e:
+            self._log(Qgis.Critical, "❌ Ошибка подключения к серверу: %s", e)
+            self._log(Qgis.Critical, "Убедитесь, что сервер запущен на %s", SERVER_URL)
             self.iface.messageBar().pushMessage(
                 "AI Assistant",
                 f"Ошибка подключения к серверу на {SERVER_URL}",
@@ -315,46 +473,32 @@ class AIAssistant:
             )
             return None, None, None
         except Exception as e:
-            QgsMessageLog.logMessage(f"❌ Ошибка отправки запроса: {str(e)}", "AI Assistant", Qgis.Critical)
-            import traceback
-            QgsMessageLog.logMessage(traceback.format_exc(), "AI Assistant", Qgis.Critical)
+            self._log(Qgis.Critical, "❌ Ошибка отправки запроса: %s", e)
+            if self._log_enabled(Qgis.Critical):
+                self._log(Qgis.Critical, "%s", traceback.format_exc())
             return None, None, None
 
-    def regenerate_code(self, original_prompt, failed_code, error_message, context, attempt=1):
-        """Try to regenerate fixed code after error"""
-        if attempt > 3:
-            QgsMessageLog.logMessage("Превышено максимальное количество попыток исправления", "AI Assistant", Qgis.Critical)
-            return None
+    def regenerate_code(self, original_prompt, history, context, context_id):
+        """Try to regenerate fixed code after error
         
+        history lists the failed attempts so far as {"failedCode", "error"} dicts.
+        """
         try:
-            url = f"{SERVER_URL}/api/regenerate"
-            
             payload = {
-                "originalPrompt": original_prompt,
-                "failedCode": failed_code,
-                "errorMessage": error_message,
-                "context": context,
-                "attempt": attempt
+                "prompt": original_prompt,
+                "contextId": context_id,
+                "history": history
             }
             
-            data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            result = self._run_in_background("AI Assistant: исправление кода", self._post_chat, payload, context)
             
-            req = urllib.request.Request(
-                url,
-                data=data,
-                headers={'Content-Type': 'application/json; charset=utf-8'}
-            )
+            error = result.get('error')
+            if error:
+                self._log(Qgis.Critical, "Ошибка регенерации: %s", error)
+                return None
             
-            with urllib.request.urlopen(req, timeout=60) as response:
-                result = json.loads(response.read().decode('utf-8'))
-                
-                if 'error' in result and result['error']:
-                    QgsMessageLog.logMessage(f"Ошибка регенерации: {result['error']}", "AI Assistant", Qgis.Critical)
-                    return None
-                
-                QgsMessageLog.logMessage(f"Объяснение исправления: {result.get('explanation', 'N/A')}", "AI Assistant", Qgis.Info)
-                return result.get('code')
+            return result.get('code')
                 
         except Exception as e:
-            QgsMessageLog.logMessage(f"Ошибка регенерации кода: {str(e)}", "AI Assistant", Qgis.Critical)
+            self._log(Qgis.Critical, "Ошибка регенерации кода: %s", e)
             return None
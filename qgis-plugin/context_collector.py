@@ -5,32 +5,203 @@ Collects project metadata, layer information, and spatial context
 """
 
 import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
 from qgis.core import (
     QgsProject,
     QgsVectorLayer,
     QgsRasterLayer,
     QgsWkbTypes,
-    QgsMapLayer
+    QgsMapLayer,
+    QgsUnitTypes,
+    QgsFieldConstraints,
+    QgsCoordinateTransform,
+    QgsCsException
 )
 
+_GEOM_NAMES = {
+    QgsWkbTypes.PointGeometry: "Point",
+    QgsWkbTypes.LineGeometry: "LineString",
+    QgsWkbTypes.PolygonGeometry: "Polygon",
+    QgsWkbTypes.UnknownGeometry: "Unknown",
+    QgsWkbTypes.NullGeometry: "Null"
+}
+
+_LAYER_TYPE_NAMES = {
+    QgsMapLayer.VectorLayer: "Vector",
+    QgsMapLayer.RasterLayer: "Raster",
+    QgsMapLayer.PluginLayer: "Plugin",
+    QgsMapLayer.MeshLayer: "Mesh",
+    QgsMapLayer.VectorTileLayer: "VectorTile",
+    QgsMapLayer.AnnotationLayer: "Annotation",
+    QgsMapLayer.PointCloudLayer: "PointCloud"
+}
+
+_UNIT_NAMES = {
+    QgsUnitTypes.DistanceMeters: "meters",
+    QgsUnitTypes.DistanceKilometers: "kilometers",
+    QgsUnitTypes.DistanceFeet: "feet",
+    QgsUnitTypes.DistanceNauticalMiles: "nautical miles",
+    QgsUnitTypes.DistanceYards: "yards",
+    QgsUnitTypes.DistanceMiles: "miles",
+    QgsUnitTypes.DistanceDegrees: "degrees",
+    QgsUnitTypes.DistanceUnknownUnit: "unknown"
+}
+
+# featureCount() may scan the provider, reuse a count for this many seconds
+FEATURE_COUNT_TTL = 5.0
+
+# Total time one collection pass may wait for feature counts. Counts that
+# are not ready by then are reported as unknown and picked up by a later
+# pass instead of blocking on remote providers (WFS, DB views, ...)
+FEATURE_COUNT_BUDGET = 0.05
+
+# Features are counted in parallel on data provider clones; provider calls
+# release the GIL
+MAX_COLLECT_WORKERS = 8
+
+# Limits of the compact context that is sent with a prompt
+PROMPT_MAX_LAYERS = 30
+PROMPT_MAX_FIELDS = 20
+COORD_DECIMALS = 6
+
+# Layer signals after which the cached description of the layer is stale
+_LAYER_SIGNALS = (
+    "nameChanged",
+    "crsChanged",
+    "dataSourceChanged",
+    "dataChanged",
+    "editingStarted",
+    "editingStopped",
+    "updatedFields",
+)
+
+
+def _round_extent(extent):
+    """Copy of an extent dict with coordinates rounded to COORD_DECIMALS"""
+    return {
+        key: round(value, COORD_DECIMALS) if isinstance(value, float) else value
+        for key, value in extent.items()
+    }
+
+
+def _count_provider_features(provider, delta):
+    """Feature count of a data provider clone plus delta, None if unknown (runs in a worker)"""
+    count = provider.featureCount()
+    if count < 0:
+        # The provider cannot tell without a full scan
+        return None
+    return count + delta
+
 
 class ContextCollector:
     """Collects full QGIS project context for AI"""
 
     def __init__(self):
         self.project = QgsProject.instance()
+        
+        # Per-layer descriptions keyed by layer id, refreshed only when dirty
+        self._layer_cache = {}
+        self._dirty = set()
+        self._feature_counts = {}
+        self._extents = {}
+        self._watched = {}
+        
+        # Feature counts still running in the pool, keyed by layer id
+        self._counting = {}
+        self._executor = ThreadPoolExecutor(max_workers=MAX_COLLECT_WORKERS)
+        
+        self.project.layersAdded.connect(self._on_layers_added)
+        self.project.layersWillBeRemoved.connect(self._on_layers_removed)
+        self.project.cleared.connect(self.invalidate_cache)
+        self._on_layers_added(self.project.mapLayers().values())
+
+    def disconnect_signals(self):
+        """Stop tracking project and layer changes (call on plugin unload)"""
+        
+        self.project.layersAdded.disconnect(self._on_layers_added)
+        self.project.layersWillBeRemoved.disconnect(self._on_layers_removed)
+        self.project.cleared.disconnect(self.invalidate_cache)
+        self._on_layers_removed(list(self._watched))
+        self.invalidate_cache()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def invalidate_cache(self):
+        """Forget all cached layer descriptions"""
+        
+        self._layer_cache.clear()
+        self._dirty.clear()
+        self._feature_counts.clear()
+        self._extents.clear()
+        self._counting.clear()
+
+    def _mark_dirty(self, layer_id, *args):
+        """Slot for layer signals: re-collect the layer on the next request"""
+        
+        self._dirty.add(layer_id)
+        self._feature_counts.pop(layer_id, None)
+        self._counting.pop(layer_id, None)
+
+    def _on_layers_added(self, layers):
+        """Watch newly added layers for changes"""
+        
+        for layer in layers:
+            layer_id = layer.id()
+            if layer_id in self._watched:
+                continue
+            
+            slot = partial(self._mark_dirty, layer_id)
+            for name in _LAYER_SIGNALS:
+                signal = getattr(layer, name, None)
+                if signal is not None:
+                    signal.connect(slot)
+            
+            self._watched[layer_id] = (layer, slot)
+            self._dirty.add(layer_id)
+
+    def _on_layers_removed(self, layer_ids):
+        """Drop cached data and signal connections of removed layers"""
+        
+        for layer_id in layer_ids:
+            self._layer_cache.pop(layer_id, None)
+            self._feature_counts.pop(layer_id, None)
+            self._extents.pop(layer_id, None)
+            self._counting.pop(layer_id, None)
+            self._dirty.discard(layer_id)
+            
+            layer, slot = self._watched.pop(layer_id, (None, None))
+            if layer is None:
+                continue
+            
+            for name in _LAYER_SIGNALS:
+                signal = getattr(layer, name, None)
+                if signal is None:
+                    continue
+                try:
+                    signal.disconnect(slot)
+                except (TypeError, RuntimeError):
+                    # Already disconnected or the C++ layer is gone
+                    pass
 
     def collect_full_context(self):
         """Collect complete project context including layers, CRS, extent"""
         
+        from qgis.utils import iface
+        
+        # Layers outside the visible map area are only listed briefly
+        visible = None
+        if iface and iface.mapCanvas():
+            canvas = iface.mapCanvas()
+            visible = (canvas.extent(), canvas.mapSettings().destinationCrs())
+        
         context = {
             "project": self._collect_project_info(),
-            "layers": self._collect_layers_info(),
+            "layers": self._collect_layers_info(visible),
             "timestamp": datetime.datetime.now().isoformat()
         }
         
         # Add active layer if exists
-        from qgis.utils import iface
         if iface and iface.activeLayer():
             context["activeLayer"] = iface.activeLayer().name()
         
@@ -47,6 +218,59 @@ class ContextCollector:
         
         return context
 
+    def summarize_for_prompt(self, context, max_layers=PROMPT_MAX_LAYERS, max_fields=PROMPT_MAX_FIELDS):
+        """
+        Compact copy of a collected context for sending to the server
+        
+        Keeps at most max_layers layers (the active one and those in view
+        first) and max_fields fields per layer, drops data sources of
+        non-active layers and extents of layers outside the map view, and
+        rounds coordinates. The cached layer descriptions are not modified.
+        """
+        
+        active = context.get("activeLayer")
+        view = context.get("mapExtent")
+        project_crs = context["project"].get("spatialReference")
+        
+        def in_view(layer):
+            if layer.get("inView") is False:
+                return False
+            extent = layer.get("extent")
+            if not view or not extent or layer.get("spatialReference") != project_crs:
+                # Cannot compare extents in different CRSs, keep the layer
+                return True
+            return not (
+                extent["xMin"] > view["xMax"] or extent["xMax"] < view["xMin"] or
+                extent["yMin"] > view["yMax"] or extent["yMax"] < view["yMin"]
+            )
+        
+        layers = context["layers"]
+        if len(layers) > max_layers:
+            ranked = sorted(
+                range(len(layers)),
+                key=lambda i: (layers[i]["name"] != active, not in_view(layers[i]))
+            )
+            layers = [layers[i] for i in sorted(ranked[:max_layers])]
+        
+        compact_layers = []
+        for layer in layers:
+            compact = dict(layer)
+            if compact["name"] != active:
+                compact.pop("dataSource", None)
+            if "fields" in compact:
+                compact["fields"] = compact["fields"][:max_fields]
+            if "extent" in compact:
+                if in_view(compact):
+                    compact["extent"] = _round_extent(compact["extent"])
+                else:
+                    del compact["extent"]
+            compact_layers.append(compact)
+        
+        summary = dict(context, layers=compact_layers)
+        if view:
+            summary["mapExtent"] = _round_extent(view)
+        return summary
+
     def _collect_project_info(self):
         """Collect basic project information"""
         
@@ -65,18 +289,91 @@ class ContextCollector:
         
         return project_info
 
-    def _collect_layers_info(self):
-        """Collect information about all layers in the project"""
+    def _collect_layers_info(self, visible=None):
+        """Collect information about all layers in the project
         
-        layers_info = []
+        visible is the (extent, CRS) of the map canvas. Layers entirely
+        outside of it are described only by name, type and id.
+        """
         
-        for layer_id, layer in self.project.mapLayers().items():
-            layer_info = self._collect_single_layer_info(layer)
-            if layer_info:
-                layers_info.append(layer_info)
+        layers = self.project.mapLayers()
+        
+        # Layers that changed since the last call are re-collected
+        for layer_id in self._dirty & layers.keys():
+            self._layer_cache.pop(layer_id, None)
+            self._extents.pop(layer_id, None)
+        self._dirty -= layers.keys()
+        
+        # Map layers belong to the main thread, so they are only read here
+        described = [(layer, self._describe_layer(layer, visible)) for layer in layers.values()]
+        counts = self._count_features([
+            layer for layer, layer_info in described
+            if layer_info and layer_info.get("inView") is not False and isinstance(layer, QgsVectorLayer)
+        ])
+        
+        layers_info = []
+        for layer, layer_info in described:
+            if not layer_info:
+                continue
+            
+            # Counts expire on their own, so they are not part of the cached description
+            if layer.id() in counts:
+                feature_count = counts[layer.id()]
+                layer_info = dict(layer_info, featureCount=feature_count)
+                if feature_count is None:
+                    layer_info["featureCountExact"] = False
+            layers_info.append(layer_info)
         
         return layers_info
 
+    def _describe_layer(self, layer, visible=None):
+        """Cached description of a layer, or a short stub if it is outside the visible extent"""
+        
+        if not layer or not layer.isValid():
+            return None
+        
+        if visible is not None and not self._is_in_view(layer, visible):
+            return {
+                "name": layer.name(),
+                "type": self._get_layer_type_name(layer.type()),
+                "id": layer.id(),
+                "inView": False
+            }
+        
+        layer_info = self._layer_cache.get(layer.id())
+        if layer_info is None:
+            layer_info = self._collect_single_layer_info(layer)
+            self._layer_cache[layer.id()] = layer_info
+        return layer_info
+
+    def _is_in_view(self, layer, visible):
+        """Whether the layer extent intersects the visible (extent, CRS)"""
+        
+        extent = self._get_extent(layer)
+        if not layer.isSpatial() or extent is None or extent.isEmpty():
+            return True
+        
+        view_extent, view_crs = visible
+        layer_crs = layer.crs()
+        if layer_crs.isValid() and view_crs.isValid() and layer_crs != view_crs:
+            try:
+                transform = QgsCoordinateTransform(layer_crs, view_crs, self.project)
+                extent = transform.transformBoundingBox(extent)
+            except QgsCsException:
+                # Cannot tell, keep the layer
+                return True
+        
+        return extent.intersects(view_extent)
+
+    def _get_extent(self, layer):
+        """Layer extent, cached until the layer changes"""
+        
+        extent = self._extents.get(layer.id())
+        if extent is None:
+            extent = layer.extent()
+            self._extents[layer.id()] = extent
+        return extent
+
     def _collect_single_layer_info(self, layer):
         """Collect detailed information about a single layer"""
         
@@ -111,26 +408,27 @@ class ContextCollector:
         
         info = {
             "geometryType": self._get_geometry_type_name(layer.geometryType()),
-            "featureCount": layer.featureCount(),
             "fields": []
         }
         
         # Collect field information
         for field in layer.fields():
+            constraints = field.constraints().constraints()
             field_info = {
                 "name": field.name(),
                 "type": field.typeName(),
                 "length": field.length(),
-                "nullable": not field.constraints().constraints() & field.constraints().ConstraintNotNull
+                "nullable": not constraints & QgsFieldConstraints.ConstraintNotNull
             }
             
-            if field.alias():
-                field_info["alias"] = field.alias()
+            alias = field.alias()
+            if alias:
+                field_info["alias"] = alias
             
             info["fields"].append(field_info)
         
         # Extent
-        extent = layer.extent()
+        extent = self._get_extent(layer)
         if extent and not extent.isEmpty():
             info["extent"] = {
                 "xMin": extent.xMinimum(),
@@ -146,6 +444,60 @@ class ContextCollector:
         
         return info
 
+    def _count_features(self, layers):
+        """Feature counts of vector layers keyed by layer id, None where unknown.
+        
+        A count is reused for FEATURE_COUNT_TTL seconds. New counts are run
+        in the worker pool on clones of the data providers, and the pass
+        waits for them at most FEATURE_COUNT_BUDGET seconds; a count that
+        takes longer is reported as unknown and picked up by a later pass.
+        """
+        
+        now = time.monotonic()
+        counts = {}
+        for layer in layers:
+            layer_id = layer.id()
+            cached = self._feature_counts.get(layer_id)
+            if cached and now - cached[0] < FEATURE_COUNT_TTL:
+                counts[layer_id] = cached[1]
+                continue
+            if layer_id in self._counting:
+                continue
+            
+            provider = layer.dataProvider()
+            if provider is None:
+                counts[layer_id] = None
+                continue
+            
+            # Unsaved edits are counted the way QgsVectorLayer.featureCount() does
+            delta = 0
+            edit_buffer = layer.editBuffer()
+            if edit_buffer is not None and not provider.transaction():
+                delta = len(edit_buffer.addedFeatures()) - len(edit_buffer.deletedFeatureIds())
+            self._counting[layer_id] = self._executor.submit(_count_provider_features, provider.clone(), delta)
+        
+        running = {
+            layer.id(): self._counting[layer.id()]
+            for layer in layers if layer.id() not in counts
+        }
+        wait(running.values(), timeout=FEATURE_COUNT_BUDGET)
+        
+        for layer_id, future in running.items():
+            if not future.done():
+                counts[layer_id] = None
+                continue
+            
+            del self._counting[layer_id]
+            try:
+                count = future.result()
+            except Exception:
+                # A failing provider means an unknown count, not a failed collection
+                count = None
+            counts[layer_id] = count
+            self._feature_counts[layer_id] = (now, count)
+        
+        return counts
+
     def _collect_raster_layer_info(self, layer):
         """Collect raster layer specific information"""
         
@@ -157,7 +509,7 @@ class ContextCollector:
         }
         
         # Extent
-        extent = layer.extent()
+        extent = self._get_extent(layer)
         if extent and not extent.isEmpty():
             info["extent"] = {
                 "xMin": extent.xMinimum(),
@@ -175,46 +527,12 @@ class ContextCollector:
 
     def _get_geometry_type_name(self, geom_type):
         """Convert QgsWkbTypes geometry type to readable name"""
-        
-        type_map = {
-            QgsWkbTypes.PointGeometry: "Point",
-            QgsWkbTypes.LineGeometry: "LineString",
-            QgsWkbTypes.PolygonGeometry: "Polygon",
-            QgsWkbTypes.UnknownGeometry: "Unknown",
-            QgsWkbTypes.NullGeometry: "Null"
-        }
-        
-        return type_map.get(geom_type, "Unknown")
+        return _GEOM_NAMES.get(geom_type, "Unknown")
 
     def _get_layer_type_name(self, layer_type):
         """Convert QgsMapLayer type to readable name"""
-        
-        type_map = {
-            QgsMapLayer.VectorLayer: "Vector",
-            QgsMapLayer.RasterLayer: "Raster",
-            QgsMapLayer.PluginLayer: "Plugin",
-            QgsMapLayer.MeshLayer: "Mesh",
-            QgsMapLayer.VectorTileLayer: "VectorTile",
-            QgsMapLayer.AnnotationLayer: "Annotation",
-            QgsMapLayer.PointCloudLayer: "PointCloud"
-        }
-        
-        return type_map.get(layer_type, "Unknown")
+        return _LAYER_TYPE_NAMES.get(layer_type, "Unknown")
 
     def _get_units_name(self, units):
         """Convert map units enum to readable name"""
-        
-        from qgis.core import QgsUnitTypes
-        
-        unit_map = {
-            QgsUnitTypes.DistanceMeters: "meters",
-            QgsUnitTypes.DistanceKilometers: "kilometers",
-            QgsUnitTypes.DistanceFeet: "feet",
-            QgsUnitTypes.DistanceNauticalMiles: "nautical miles",
-            QgsUnitTypes.DistanceYards: "yards",
-            QgsUnitTypes.DistanceMiles: "miles",
-            QgsUnitTypes.DistanceDegrees: "degrees",
-            QgsUnitTypes.DistanceUnknownUnit: "unknown"
-        }
-        
-        return unit_map.get(units, "unknown")
+        return _UNIT_NAMES.get(units, "unknown")